@@ -4,12 +4,14 @@ import math
 import copy
 import sys,os
 sys.path.append(os.path.abspath(sys.path[0] + '/..'))
+from traffic_light_tracker import TrafficLightTrack, NO_TRAFFIC_LIGHT, MAX_DEPTH
 
 
 STOP_COUNTS = 3 #number of iterations to exit DANGEROUS state
 DECEL_THRESHOLD = 15  #minimum distance in meters to enter in TRAFFICLIGHT_STOP state if a traffic light is detected
 LAST_CHECK_DISTANCE=7  #minimum distance in meters to decide behaviour of the ego_vehicle close to traffic light
 THRESHOLD_ORIENTATION=15 #used offset to check the ego_vehicle's orientation
+TL_MAX_DETECTION_AGE=0.5 #maximum age in seconds of a traffic light detection used by the state machine
 
 
 # State machine states
@@ -31,8 +33,7 @@ class BehaviouralPlanner:
         self._lookahead_collision_index = 0
         self._previous_state = -1
         self._stop_count = 0
-        self._tl_state_history=[]
-        self._depth_history=[]
+        self._tl_track=TrafficLightTrack()
         self._handbrake=False
         self._in_intersection=False
 
@@ -41,13 +42,30 @@ class BehaviouralPlanner:
         self._lookahead = lookahead
 
     # Handles state transitions and computes the goal state.
-    def transition_state(self, waypoints, ego_state,tl_depth, traffic_light_state):
+    def transition_state(self, waypoints, ego_state,tl_depth, traffic_light_state, timestamp=None, tl_age=0.0, tl_fresh=True):
         """Handles state transitions and computes the goal state.
 
+        The detected depth is filtered by the traffic light track, which also
+        bridges the frames where the detector does not return the traffic light;
+        the decisions below use the filtered depth.
+
+        args:
+            tl_depth: measured depth (m) of the traffic light, MAX_DEPTH if none.
+            traffic_light_state: detected state [0,1,2] = [GO,STOP,NO_TRAFFIC_LIGHT].
+            timestamp: simulation time (s) of the frame, used by the depth filter.
+            tl_age: age (s) of the detection, which is discarded when older
+                than TL_MAX_DETECTION_AGE.
+            tl_fresh: false when the detection was already passed on a
+                previous tick, in which case it is not added to the track
+                again and the filtered depth of the track is used.
         """
+        if tl_age > TL_MAX_DETECTION_AGE:
+            traffic_light_state, tl_depth = NO_TRAFFIC_LIGHT, MAX_DEPTH
+        if tl_fresh:
+            tl_depth = self._tl_track.update(traffic_light_state, tl_depth, ego_state[3], timestamp)
+        else:
+            tl_depth = self._tl_track.filtered_depth
         print(f"BEHAVIOURAL PLANNER -> stato : {self._state} | precedente : {self._previous_state} | depth : {tl_depth}")
-        self._depth_history.append(tl_depth)
-        self._tl_state_history.append(traffic_light_state)
         self._handbrake=False
         self._in_intersection=False
 
@@ -74,21 +92,16 @@ class BehaviouralPlanner:
                 self._goal_state = waypoints[goal_index]
 
                 #set the previous_state to FOLLOW_LANE if there are five consecutive no detections
-                if self._tl_state_history[-5:]==[2,2,2,2,2]:
+                if self._tl_track.recent_states_are(2, 5):
                     self._previous_state=FOLLOW_LANE
 
                 #if the previous_state is not equal to TRAFFICLIGHT_STOP, then check if there is a traffic light closer the ego_vehicle
                 if self._previous_state != TRAFFICLIGHT_STOP:
-                    if len(self._depth_history)>=3:
-                        depth_flag=False
-                        for d in self._depth_history[-3:]:
-                            if d<=DECEL_THRESHOLD:
-                                depth_flag=True
-                        #compute the next goal_state according to the position of traffic light if there is one
-                        if depth_flag:
-                            self._goal_state=self.compute_tl_goal(ego_state,tl_depth,waypoints,goal_index,THRESHOLD_ORIENTATION)
-                            self._previous_state = self._state
-                            self._state = TRAFFICLIGHT_STOP
+                    #compute the next goal_state according to the position of traffic light if there is one
+                    if self._tl_track.recent_depths_within(DECEL_THRESHOLD, 3):
+                        self._goal_state=self.compute_tl_goal(ego_state,tl_depth,waypoints,goal_index,THRESHOLD_ORIENTATION)
+                        self._previous_state = self._state
+                        self._state = TRAFFICLIGHT_STOP
 
 
         elif self._state == TRAFFICLIGHT_STOP:
@@ -103,20 +116,20 @@ class BehaviouralPlanner:
                 #decide  the ego_vehicle 's behaviour close to the traffic light
                 if tl_depth<=LAST_CHECK_DISTANCE:
                     #decide the ego_vehicle 's behaviour if there are two consecutive traffic light red states
-                    if self._tl_state_history[-2:]==[1,1]:
+                    if self._tl_track.recent_states_are(1, 2):
                         self._goal_state[2] = 0
                         if tl_depth<=4:
                             self._handbrake = True
                     #decide the ego_vehicle 's behaviour if there are six consecutive traffic light green states
-                    elif self._tl_state_history[-6:]==[0,0,0,0,0,0]:
+                    elif self._tl_track.recent_states_are(0, 6):
                         self._previous_state = self._state
                         self._state = FOLLOW_LANE
                 #if we lose the traffic light detection and the ego_vehicle's speed is near 0, just move a bit
-                elif self._tl_state_history[-5:]==[2,2,2,2,2] and ego_state[3]<=0.5:
+                elif self._tl_track.recent_states_are(2, 5) and ego_state[3]<=0.5:
                     self._goal_state[2]=1.5
                 else:
                     #set the state to FOLLOW_LANE if there are seven consecutive no detections
-                    if self._tl_state_history[-7:]==[2,2,2,2,2,2,2]:
+                    if self._tl_track.recent_states_are(2, 7):
                         self._state = FOLLOW_LANE
 
         elif self._state == DANGEROUS:
@@ -136,7 +149,7 @@ class BehaviouralPlanner:
                     if self._previous_state==FOLLOW_LANE:
                         self._state = self._previous_state
                         self._goal_state = self._previous_goal_state
-                        if self._depth_history[-1]<=LAST_CHECK_DISTANCE:
+                        if self._tl_track.last_depth<=LAST_CHECK_DISTANCE:
                             self._state=TRAFFICLIGHT_STOP
                             closest_len, closest_index = get_closest_index(waypoints, ego_state)
                             goal_index = self.get_goal_index(waypoints, ego_state, closest_len, closest_index)
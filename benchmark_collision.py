@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the collision checker engines over growing obstacle sets.
+
+Compares, on the local planner's path set, the original per-point loop, the
+dense vectorized check and the ObstacleIndex (KD-tree) radius queries, for
+obstacle counts from 10 to 10,000 border points, along with the share of
+path-obstacle pairs rejected by the bounding box broad phase:
+    python benchmark_collision.py
+"""
+import time
+import numpy as np
+import scipy.spatial
+import collision_checker
+
+NUM_PATHS      = 7
+PATH_OFFSET    = 1.5               # m
+PATH_LENGTH    = 30.0              # m
+PATH_POINTS    = 49
+CIRCLE_OFFSETS = [-1.0, 1.0, 3.0]  # m
+CIRCLE_RADII   = [1.5, 1.5, 1.5]   # m
+MAP_OBSTACLE_THRESHOLD = 30        # m
+
+OBSTACLE_COUNTS = [10, 100, 1000, 10000]
+REPEATS = 5
+
+def make_paths(ego_x=100.0, ego_y=50.0):
+    """Straight, laterally offset paths ahead of the ego vehicle."""
+    s = np.linspace(0.0, PATH_LENGTH, PATH_POINTS)
+    paths = []
+    for i in range(NUM_PATHS):
+        offset = (i - NUM_PATHS // 2) * PATH_OFFSET
+        paths.append([(ego_x + s).tolist(),
+                      (ego_y + offset + 0.0*s).tolist(),
+                      np.zeros(PATH_POINTS + 1).tolist()])
+    return paths
+
+def make_obstacles(num, rng, ego_x=100.0, ego_y=50.0):
+    """Border points of car sized obstacles around the ego vehicle, laid out
+    like obstacle_to_world in main.py and kept clear of the path corridor so
+    that every path has to be fully checked."""
+    num_obstacles = max(num // collision_checker.OBSTACLE_BORDER_POINTS, 1)
+    centres = np.empty((0, 2))
+    while len(centres) < num_obstacles:
+        batch = rng.uniform(-MAP_OBSTACLE_THRESHOLD, MAP_OBSTACLE_THRESHOLD,
+                            (num_obstacles, 2))
+        batch = batch[np.abs(batch[:, 1]) > 10.0]
+        centres = np.vstack((centres, batch))
+    centres = centres[:num_obstacles] + [ego_x, ego_y]
+
+    xrad, yrad = 2.0, 1.0
+    border = np.array([[-xrad, -xrad, -xrad, 0,    xrad, xrad, xrad,  0    ],
+                       [-yrad, 0,     yrad,  yrad, yrad, 0,    -yrad, -yrad]])
+    yaws = rng.uniform(-np.pi, np.pi, num_obstacles)
+    x = centres[:, 0:1] + np.cos(yaws)[:, None]*border[0] \
+                        + np.sin(yaws)[:, None]*border[1]
+    y = centres[:, 1:2] - np.sin(yaws)[:, None]*border[0] \
+                        + np.cos(yaws)[:, None]*border[1]
+    return np.column_stack((x.ravel(), y.ravel()))
+
+def reference_collision_check(paths, obstacles):
+    """The original per-path, per-point collision check loop."""
+    collision_check_array = np.zeros(len(paths), dtype=bool)
+    circle_offset = np.array(CIRCLE_OFFSETS)
+    for i in range(len(paths)):
+        collision_free = True
+        path = paths[i]
+        for j in range(len(path[0])):
+            circle_locations = np.zeros((len(CIRCLE_OFFSETS), 2))
+            circle_locations[:, 0] = path[0][j] + circle_offset * np.cos(path[2][j])
+            circle_locations[:, 1] = path[1][j] + circle_offset * np.sin(path[2][j])
+            collision_dists = scipy.spatial.distance.cdist(obstacles,
+                                                           circle_locations)
+            collision_dists = np.subtract(collision_dists, CIRCLE_RADII)
+            collision_free = collision_free and not np.any(collision_dists < 0)
+            if not collision_free:
+                break
+        collision_check_array[i] = collision_free
+    return collision_check_array
+
+def timed(function):
+    """Returns the result of function() and its mean run time in ms."""
+    start = time.time()
+    for _ in range(REPEATS):
+        result = function()
+    return result, 1000*(time.time() - start)/REPEATS
+
+def main():
+    rng = np.random.RandomState(0)
+    checker = collision_checker.CollisionChecker(CIRCLE_OFFSETS, CIRCLE_RADII,
+                                                 10)
+    paths = make_paths()
+
+    print('%9s %12s %12s %12s %12s %12s' %
+          ('obstacles', 'loop (ms)', 'dense (ms)', 'build+query', 'query (ms)',
+           'pruned pairs'))
+    for num in OBSTACLE_COUNTS:
+        obstacles = make_obstacles(num, rng)
+        # Move the first obstacle onto one of the paths so that both outcomes
+        # occur.
+        obstacles[:8] += [paths[0][0][-1], paths[0][1][-1]] - obstacles[0]
+
+        loop, loop_time = timed(
+            lambda: reference_collision_check(paths, obstacles))
+        pruning = checker.get_pruning_stats()
+        dense, dense_time = timed(
+            lambda: checker.collision_check(paths, obstacles))
+        pruned = checker.get_pruning_stats()['pruned_pairs'] - \
+            pruning['pruned_pairs']
+        pairs = checker.get_pruning_stats()['pairs'] - pruning['pairs']
+        index, index_time = timed(
+            lambda: checker.collision_check(
+                paths, collision_checker.ObstacleIndex(obstacles)))
+        obstacle_index = collision_checker.ObstacleIndex(obstacles)
+        query, query_time = timed(
+            lambda: checker.collision_check(paths, obstacle_index))
+
+        assert np.array_equal(loop, dense) and np.array_equal(loop, index) \
+            and np.array_equal(loop, query)
+        print('%9d %12.3f %12.3f %12.3f %12.3f %11.1f%%' %
+              (len(obstacles), loop_time, dense_time, index_time, query_time,
+               100.0*pruned/pairs))
+
+if __name__ == '__main__':
+    main()
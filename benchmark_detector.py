@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the traffic light detector in full frame and region of interest
+(ROI) modes.
+
+Runs both modes on the annotated CARLA frames of the training dataset and
+reports the mean and 95th percentile inference latency (preprocessing,
+network and decoding) along with the detection recall, i.e. the share of the
+annotated traffic lights matched by the detected box (IoU >= IOU_THRESHOLD),
+and how many annotated traffic lights lie inside of the ROI at all:
+    python benchmark_detector.py dataset/annotations.csv [--limit N]
+
+With --backends, the Keras model is instead compared with its TensorFlow Lite
+conversions (float and int8) on the same frames: network latency, largest
+difference of the output grid from the Keras output, and agreement of the
+detected box (same label and IoU >= PARITY_IOU, or no box for both).
+"""
+import argparse
+import os
+import time
+import cv2
+import numpy as np
+
+from carla_detector_model_traffic_light import get_model_from_file, \
+    get_tflite_model, predict_with_model_from_image, preprocess_image, \
+    roi_input_size, roi_boxes_to_image, image_size, classes, anchors, \
+    num_classes, obj_thresh, nms_thresh
+from postprocessing import compute_overlap, decode_netout
+from preprocessing import load_carla_data
+from tflite_backend import PARITY_TOLERANCE
+
+# Images of the training dataset, as in utils.py
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dataset', 'images')
+TL_ROI = [0.4, 0.0, 1.0, 0.55]  # same band as in main.py
+IOU_THRESHOLD = 0.3
+WARMUP_FRAMES = 5
+CALIBRATION_FRAMES = 100  # frames used to quantize the int8 activations
+PARITY_IOU = 0.5
+
+def load_frames(annotation_file, limit=None):
+    """Returns the [image, boxes, labels] of the annotated frames, with the
+    boxes as fractions of the image."""
+    frames = []
+    for instance in load_carla_data(annotation_file, classes)[:limit]:
+        image = cv2.imread(os.path.join(IMAGES_DIR, instance['image_path']))
+        if image is None:
+            continue
+        image_h, image_w = image.shape[:2]
+        boxes = np.array([[obj['xmin'] / image_w, obj['ymin'] / image_h,
+                           obj['xmax'] / image_w, obj['ymax'] / image_h]
+                          for obj in instance['object']])
+        labels = np.array([classes.index(obj['class'])
+                           for obj in instance['object']])
+        frames.append((image, boxes, labels))
+    return frames
+
+def run_mode(model, input_size, frames, roi=None):
+    """Returns the latencies (s) and the number of matched and correctly
+    labelled annotated traffic lights of one detection mode."""
+    for image, _, _ in frames[:WARMUP_FRAMES]:
+        predict_with_model_from_image(model, preprocess_image(image, input_size, roi))
+
+    latencies = []
+    matched = correct = 0
+    for image, boxes, labels in frames:
+        start = time.time()
+        detections = predict_with_model_from_image(
+            model, preprocess_image(image, input_size, roi))
+        if roi is not None:
+            detections = roi_boxes_to_image(detections, roi)
+        latencies.append(time.time() - start)
+
+        for box in detections:
+            iou = compute_overlap(np.array([[box.xmin, box.ymin, box.xmax, box.ymax]]),
+                                  boxes)[0]
+            hits = iou >= IOU_THRESHOLD
+            matched += np.count_nonzero(hits)
+            correct += np.count_nonzero(hits & (labels == box.get_label()))
+    return np.array(latencies), matched, correct
+
+def compare_backends(frames, input_size=image_size):
+    """Prints the latency of the Keras and TensorFlow Lite backends and
+    the parity of the TensorFlow Lite outputs with the Keras ones."""
+    images = [preprocess_image(image, input_size) for image, _, _ in frames]
+    keras_model = get_model_from_file(input_size)
+    backends = [('keras', keras_model),
+                ('tflite', get_tflite_model(input_size, rebuild=True)),
+                ('tflite int8', get_tflite_model(input_size, True,
+                                                 images[:CALIBRATION_FRAMES],
+                                                 rebuild=True))]
+
+    print('%-12s %10s %10s %14s %10s' %
+          ('backend', 'mean (ms)', 'p95 (ms)', 'max |diff|', 'same box'))
+    reference = None
+    for name, model in backends:
+        for image in images[:WARMUP_FRAMES]:
+            model.predict(image)
+        latencies, netouts = [], []
+        for image in images:
+            start = time.time()
+            netouts.append(model.predict(image)[0])
+            latencies.append(time.time() - start)
+        if reference is None:
+            reference = netouts
+
+        difference = max(np.max(np.abs(netout - ref))
+                         for netout, ref in zip(netouts, reference))
+        same = np.mean([same_detection(netout, ref)
+                        for netout, ref in zip(netouts, reference)])
+        print('%-12s %10.2f %10.2f %14.2e %9.1f%%' %
+              (name, 1000*np.mean(latencies), 1000*np.percentile(latencies, 95),
+               difference, 100*same))
+        if name == 'tflite' and difference > PARITY_TOLERANCE:
+            print('tflite output differs from keras by more than %g' %
+                  PARITY_TOLERANCE)
+
+def same_detection(netout, reference):
+    """Returns true if both outputs decode to the same traffic light."""
+    boxes = [decode_netout(n, anchors, num_classes, obj_thresh, nms_thresh)
+             for n in (netout, reference)]
+    if not boxes[0] or not boxes[1]:
+        return not boxes[0] and not boxes[1]
+    box, ref = boxes[0][0], boxes[1][0]
+    iou = compute_overlap(np.array([[box.xmin, box.ymin, box.xmax, box.ymax]]),
+                          np.array([[ref.xmin, ref.ymin, ref.xmax, ref.ymax]]))
+    return box.get_label() == ref.get_label() and iou[0, 0] >= PARITY_IOU
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('annotation_file', help='csv annotations of the dataset')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='number of frames to use')
+    parser.add_argument('--backends', action='store_true',
+                        help='compare the keras and tflite backends')
+    args = parser.parse_args()
+
+    frames = load_frames(args.annotation_file, args.limit)
+    if args.backends:
+        compare_backends(frames)
+        return
+
+    num_boxes = sum(len(boxes) for _, boxes, _ in frames)
+    image_h, image_w = frames[0][0].shape[:2]
+    in_roi = sum(np.count_nonzero(np.all((boxes[:, :2] >= TL_ROI[:2]) &
+                                         (boxes[:, 2:] <= TL_ROI[2:]), axis=1))
+                 for _, boxes, _ in frames)
+    print('%d frames, %d traffic lights, %.1f%% inside of the ROI %s' %
+          (len(frames), num_boxes, 100.0*in_roi/num_boxes, TL_ROI))
+
+    roi_size = roi_input_size(TL_ROI, image_w, image_h)
+    modes = [('full frame', get_model_from_file(), image_size, None),
+             ('ROI', get_model_from_file(roi_size), roi_size, TL_ROI)]
+    print('%-11s %11s %10s %10s %8s %9s' %
+          ('mode', 'input', 'mean (ms)', 'p95 (ms)', 'recall', 'correct'))
+    for name, model, input_size, roi in modes:
+        latencies, matched, correct = run_mode(model, input_size, frames, roi)
+        print('%-11s %11s %10.2f %10.2f %7.1f%% %8.1f%%' %
+              (name, '%dx%d' % tuple(input_size), 1000*np.mean(latencies),
+               1000*np.percentile(latencies, 95), 100.0*matched/num_boxes,
+               100.0*correct/max(matched, 1)))
+
+if __name__ == '__main__':
+    main()
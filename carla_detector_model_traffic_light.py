@@ -2,16 +2,11 @@ import json
 import os
 import argparse
 import cv2
-from yolo import YOLO, dummy_loss
-from keras.models import load_model
-from preprocessing import load_image_predict
 from postprocessing import decode_netout
 import numpy as np
 
 from postprocessing import draw_boxes
 
-from yolo import YOLO
-
 
 BASE_DIR = os.path.dirname(__file__)
 
@@ -21,16 +16,143 @@ num_classes=2
 obj_thresh=0.35
 nms_thresh=0.01
 max_obj=5
+image_size=(416,416)  # (width, height) of the model input for the full frame
+grid_cell=32          # downsampling of the feature extractor, pixels per grid cell
+
+MODEL_FILE = os.path.join(BASE_DIR, 'model_traffic_light.h5')
+INFERENCE_MODEL_FILE = os.path.join(BASE_DIR, 'model_traffic_light_inference.h5')
+BACKENDS = ('keras', 'tflite')
+
+def get_model_from_file(input_size=None, backend='keras', quantize=False):
+    '''
+    Load the inference-only detector model (image in, output grid out), exported by export_model_to_file, or strip the
+    training inputs from the trained model if it has not been exported. If input_size = (width, height) is given, the
+    model is rebuilt for that input size. With the 'tflite' backend the model is run by TensorFlow Lite, optionally
+    quantized to int8; both backends have the same predict(). Keras and TensorFlow are only imported by the 'keras'
+    backend, or to convert the TensorFlow Lite model the first time.
+    '''
+    if backend not in BACKENDS:
+        raise ValueError('Unknown detector backend %r, expected one of %s' % (backend, BACKENDS))
+    if backend == 'tflite':
+        return get_tflite_model(input_size or image_size, quantize)
 
-def get_model_from_file():
-    path = os.path.join(BASE_DIR, 'model_traffic_light.h5')
-    model = load_model(path, custom_objects={'custom_loss': dummy_loss}, compile=False)
+    import tensorflow as tf
+    from keras.models import load_model
+    from yolo import dummy_loss, inference_model
+
+    if os.path.exists(INFERENCE_MODEL_FILE):
+        model = load_model(INFERENCE_MODEL_FILE, compile=False)
+    else:
+        model = inference_model(load_model(MODEL_FILE, custom_objects={'custom_loss': dummy_loss}, compile=False))
+    if input_size is not None and tuple(input_size) != image_size:
+        model = resize_model_input(model, input_size)
+    # Build the predict function now and remember the graph of the model, so
+    # that the model can also be run from the detection worker thread.
+    model._make_predict_function()
+    model.graph = tf.get_default_graph()
     return model
 
+def tflite_model_file(input_size, quantize=False):
+    return os.path.join(BASE_DIR, 'model_traffic_light_%dx%d%s.tflite' %
+                        (input_size[0], input_size[1], '_int8' if quantize else ''))
+
+def get_tflite_model(input_size=image_size, quantize=False, representative_images=None, rebuild=False):
+    '''
+    Load the TensorFlow Lite detector model for input_size = (width, height), converting the Keras model the first time.
+    The activations of the int8 model are only quantized if representative_images (preprocessed model inputs) are given
+    for the conversion.
+    '''
+    from tflite_backend import TFLiteModel, convert_model
+
+    path = tflite_model_file(input_size, quantize)
+    if rebuild or not os.path.exists(path):
+        convert_model(get_model_from_file(input_size), path, quantize, representative_images)
+    return TFLiteModel(path)
+
+def resize_model_input(model, input_size):
+    '''
+    Rebuild the model for images of input_size = (width, height), multiples of grid_cell. The network is fully
+    convolutional, so the same weights apply and only the input shape and the output grid change.
+    '''
+    import tensorflow as tf
+    from keras.models import Model
+
+    input_w, input_h = input_size
+    config = _resize_layer_config(model.get_config(), input_w, input_h)
+    resized = Model.from_config(config, custom_objects={'tf': tf})
+    resized.set_weights(model.get_weights())
+    return resized
+
+def _resize_layer_config(config, input_w, input_h):
+    # Walk the (nested) layer configurations, replacing the image input shape and the output grid shape.
+    if isinstance(config, list):
+        return [_resize_layer_config(c, input_w, input_h) for c in config]
+    if not isinstance(config, dict):
+        return config
+    config = {key: _resize_layer_config(value, input_w, input_h) for key, value in config.items()}
+    layer_config = config.get('config')
+    if config.get('class_name') == 'InputLayer' and len(layer_config['batch_input_shape']) == 4:
+        layer_config['batch_input_shape'] = (None, input_h, input_w, 3)
+    elif config.get('class_name') == 'Reshape':
+        layer_config['target_shape'] = (input_h // grid_cell, input_w // grid_cell) + \
+                                       tuple(layer_config['target_shape'][2:])
+    return config
+
+def roi_input_size(roi, image_w, image_h):
+    '''
+    Return the (width, height) model input size for the region of interest roi = [xmin, ymin, xmax, ymax] (fractions
+    of the image), keeping the scale of the full frame rounded to whole grid cells.
+    '''
+    scale_w, scale_h = image_size[0] / image_w, image_size[1] / image_h
+    roi_w = (roi[2] - roi[0]) * image_w * scale_w
+    roi_h = (roi[3] - roi[1]) * image_h * scale_h
+    return (max(int(round(roi_w / grid_cell)), 1) * grid_cell,
+            max(int(round(roi_h / grid_cell)), 1) * grid_cell)
+
+def preprocess_image(image_BGR, input_size=image_size, roi=None):
+    '''
+    Crop the BGR(A) image to the region of interest roi = [xmin, ymin, xmax, ymax] (fractions of the image), if
+    given, and convert it to the normalized RGB batch of one image of input_size = (width, height) fed to the model.
+    '''
+    if roi is not None:
+        image_h, image_w = image_BGR.shape[:2]
+        image_BGR = image_BGR[int(roi[1] * image_h):int(roi[3] * image_h),
+                              int(roi[0] * image_w):int(roi[2] * image_w)]
+    image_RGB = cv2.cvtColor(image_BGR, cv2.COLOR_BGR2RGB)
+    image_RGB = cv2.resize(image_RGB, tuple(input_size))
+    image_RGB = image_RGB / 255
+    return np.expand_dims(image_RGB, 0)
+
+def roi_boxes_to_image(boxes, roi):
+    '''
+    Map boxes detected in the region of interest roi = [xmin, ymin, xmax, ymax] back to fractions of the full image.
+    '''
+    roi_w, roi_h = roi[2] - roi[0], roi[3] - roi[1]
+    for box in boxes:
+        box.xmin = roi[0] + box.xmin * roi_w
+        box.xmax = roi[0] + box.xmax * roi_w
+        box.ymin = roi[1] + box.ymin * roi_h
+        box.ymax = roi[1] + box.ymax * roi_h
+    return boxes
+
+def export_model_to_file(model_file=MODEL_FILE, inference_model_file=INFERENCE_MODEL_FILE):
+    '''
+    Save the inference-only graph of the trained detector model.
+    '''
+    from keras.models import load_model
+    from yolo import dummy_loss, inference_model
+
+    model = load_model(model_file, custom_objects={'custom_loss': dummy_loss}, compile=False)
+    inference_model(model).save(inference_model_file, include_optimizer=False)
+
 def predict_with_model_from_image(model, image):
 
-    dummy_array = np.zeros((1, 1, 1, 1, max_obj, 4))
-    netout = model.predict([image, dummy_array])[0]
+    graph = getattr(model, 'graph', None)
+    if graph is not None:
+        with graph.as_default():
+            netout = model.predict(image)[0]
+    else:
+        netout = model.predict(image)[0]
 
     boxes = decode_netout(netout=netout, anchors=anchors,
                           nb_class=num_classes,
@@ -44,3 +166,8 @@ def detect_image(image_RGB, image_BGR, model):
     plt_image = draw_boxes(image_BGR, netout, classes)
 
     return plt_image,netout
+
+
+if __name__ == '__main__':
+    export_model_to_file()
+    print('Exported %s' % INFERENCE_MODEL_FILE)
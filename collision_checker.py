@@ -1,7 +1,169 @@
 #!/usr/bin/env python3
 import numpy as np
 import scipy.spatial
-from math import sin, cos, pi, sqrt
+from planned_path import PlannedPath
+
+# Number of consecutive border points describing each obstacle, as produced by
+# obstacle_to_world in main.py. It is only used to group the points into
+# obstacle bounding boxes for the broad phase, and point sets that do not
+# split into such groups fall back to one box per point.
+OBSTACLE_BORDER_POINTS = 8
+
+# Time horizon (s) and time step (s) of the predicted obstacle motion, and the
+# number of time steps on either side of the time at which the ego vehicle
+# reaches a path point that are also checked, to absorb timing errors. The
+# arrival times come from a planned speed profile that the vehicle only
+# follows approximately, so the window also grows with the arrival time, by
+# PREDICTION_TIME_UNCERTAINTY times the arrival time on either side.
+PREDICTION_HORIZON          = 5.0
+PREDICTION_TIME_STEP        = 0.1
+PREDICTION_TIME_WINDOW      = 2
+PREDICTION_TIME_UNCERTAINTY = 0.5
+
+# Lowest speed (m/s) used to compute the time at which the ego vehicle reaches
+# each path point, so that a stopped vehicle still gets finite times.
+MIN_PATH_SPEED = 1.0
+
+# Spatial index over a set of obstacle border points, built once per planner
+# tick so that the collision checks only ever touch the points near a path.
+class ObstacleIndex:
+    def __init__(self, obstacles, points_per_obstacle=OBSTACLE_BORDER_POINTS):
+        """Builds a KD-tree and the bounding boxes of the obstacles.
+
+        args:
+            obstacles: A list of [x, y] points that represent points along the
+                border of obstacles, in the global frame.
+                Format: [[x0, y0],
+                         [x1, y1],
+                         ...,
+                         [xn, yn]]
+            points_per_obstacle: Number of consecutive points that belong to
+                the same obstacle.
+        """
+        self._points = np.asarray(obstacles, dtype=float).reshape(-1, 2)
+        self._boxes = obstacle_boxes(self._points, points_per_obstacle)
+        self._tree = None
+        if len(self._points) > 0:
+            self._tree = scipy.spatial.cKDTree(self._points)
+
+    def __len__(self):
+        return len(self._points)
+
+    @property
+    def points(self):
+        return self._points
+
+    @property
+    def boxes(self):
+        return self._boxes
+
+    def nearest_distances(self, points, max_distance):
+        """Returns the distance from each point to its closest obstacle point.
+
+        args:
+            points: Array of [x, y] query points, of shape (n, 2).
+            max_distance: Distance (m) beyond which the obstacles are ignored.
+        returns:
+            distances: Array of n distances (m), set to inf where there is no
+                obstacle point within max_distance (or the point is NaN).
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        distances = np.full(len(points), np.inf)
+        finite = np.all(np.isfinite(points), axis=1)
+        if self._tree is not None and np.any(finite):
+            distances[finite] = self._tree.query(
+                points[finite], k=1, distance_upper_bound=max_distance)[0]
+        return distances
+
+# Predicted motion of a set of obstacles over a short time horizon, sampled as
+# a time-indexed array of their border points.
+class ObstaclePrediction:
+    def __init__(self, borders, centres, yaws, speeds, yaw_rates=None,
+                 horizon=PREDICTION_HORIZON, time_step=PREDICTION_TIME_STEP):
+        """Predicts the border points of the obstacles over the horizon.
+
+        Each obstacle moves with a constant velocity along its heading, or
+        with a constant turn rate if its yaw rate is non-zero (CTRV model),
+        and its border points move rigidly with it.
+
+        args:
+            borders: Array of shape (obstacles, points, 2) with the current
+                [x, y] border points of each obstacle, in the global frame.
+            centres: Array of shape (obstacles, 2) with the current [x, y]
+                position of each obstacle (m).
+            yaws: Array of the current heading of each obstacle (rad).
+            speeds: Array of the current speed of each obstacle (m/s).
+            yaw_rates: Array of the yaw rate of each obstacle (rad/s). Zero
+                (constant velocity) if not given.
+            horizon: Time horizon of the prediction (s).
+            time_step: Time between two predicted samples (s).
+        """
+        centres = np.asarray(centres, dtype=float).reshape(-1, 2)
+        borders = np.asarray(borders, dtype=float)
+        if len(centres) > 0:
+            borders = borders.reshape(len(centres), -1, 2)
+        else:
+            borders = borders.reshape(0, OBSTACLE_BORDER_POINTS, 2)
+        yaws = np.asarray(yaws, dtype=float)
+        speeds = np.asarray(speeds, dtype=float)
+        if yaw_rates is None:
+            yaw_rates = np.zeros(len(centres))
+        yaw_rates = np.asarray(yaw_rates, dtype=float)
+        self._time_step = time_step
+        self._times = np.arange(0.0, horizon + 0.5*time_step, time_step)
+
+        # Displacement and rotation of each obstacle at each time, of shape
+        # (times, obstacles). The constant velocity model is the limit of
+        # CTRV as the yaw rate goes to zero.
+        t = self._times[:, None]
+        turn = yaw_rates*t
+        turning = np.abs(yaw_rates) > 1e-6
+        safe_rates = np.where(turning, yaw_rates, 1.0)
+        dx = np.where(turning,
+                      speeds/safe_rates*(np.sin(yaws + turn) - np.sin(yaws)),
+                      speeds*t*np.cos(yaws))
+        dy = np.where(turning,
+                      speeds/safe_rates*(np.cos(yaws) - np.cos(yaws + turn)),
+                      speeds*t*np.sin(yaws))
+
+        # Border points rotated around their obstacle's centre and moved, of
+        # shape (times, obstacles, points, 2).
+        rel = borders - centres[:, None, :]
+        cos_t = np.cos(turn)[:, :, None]
+        sin_t = np.sin(turn)[:, :, None]
+        self._borders = np.empty((len(self._times),) + borders.shape)
+        self._borders[..., 0] = centres[:, 0, None] + dx[:, :, None] \
+            + cos_t*rel[..., 0] - sin_t*rel[..., 1]
+        self._borders[..., 1] = centres[:, 1, None] + dy[:, :, None] \
+            + sin_t*rel[..., 0] + cos_t*rel[..., 1]
+
+        # Bounding box of each obstacle swept over the whole horizon.
+        swept = self._borders.transpose(1, 0, 2, 3).reshape(
+            -1, len(self._times)*borders.shape[1], 2)
+        self._boxes = obstacle_boxes(swept.reshape(-1, 2), swept.shape[1])
+
+    def __len__(self):
+        return self._borders.shape[1]
+
+    @property
+    def borders(self):
+        return self._borders
+
+    @property
+    def boxes(self):
+        return self._boxes
+
+    @property
+    def time_step(self):
+        return self._time_step
+
+    def time_indices(self, times):
+        """Returns the index of the predicted sample closest to each time,
+        clipped to the horizon. NaN times map to the first sample.
+        """
+        times = np.nan_to_num(np.asarray(times, dtype=float))
+        return np.clip(np.rint(times/self._time_step), 0,
+                       len(self._times) - 1).astype(int)
 
 class CollisionChecker:
     def __init__(self, circle_offsets, circle_radii, weight):
@@ -10,6 +172,15 @@ class CollisionChecker:
         self._weight         = weight
         self._circle_offsets_pedestrian = [-0.5, 0.5, 1.5]
         self._circle_radii_pedestrian = [0.5,0.5, 0.5]
+        # Collision circles used against each class of obstacles by
+        # collision_check_classes, as (circle_offsets, circle_radii).
+        self._obstacle_classes = {
+            'car': (self._circle_offsets, self._circle_radii),
+            'pedestrian': (self._circle_offsets_pedestrian,
+                           self._circle_radii_pedestrian)}
+        self._pruning_stats = {'checks': 0,
+                               'pairs': 0, 'pruned_pairs': 0,
+                               'paths': 0, 'pruned_paths': 0}
 
     # Takes in a set of paths and obstacles, and returns an array
     # of bools that says whether or not each path is collision free.
@@ -32,6 +203,8 @@ class CollisionChecker:
                          ...,
                          [xn, yn]]
                 , where n is the number of obstacle points and units are [m, m]
+                An ObstacleIndex built over these points can be given instead,
+                to replace the dense distance computation by radius queries.
 
         returns:
             collision_check_array: A list of boolean values which classifies
@@ -39,58 +212,8 @@ class CollisionChecker:
                 ith index in the collision_check_array list corresponds to the
                 ith path in the paths list.
         """
-        collision_check_array = np.zeros(len(paths), dtype=bool)
-
-
-        for i in range(len(paths)):
-            collision_free = True
-            path= paths[i]
-
-            # Iterate over the points in the path.
-            for j in range(len(path[0])):
-                # Compute the circle locations along this point in the path.
-                # These circle represent an approximate collision
-                # border for the vehicle, which will be used to check
-                # for any potential collisions along each path with obstacles.
-
-                # The circle offsets are given by self._circle_offsets.
-                # The circle offsets need to placed at each point along the path,
-                # with the offset rotated by the yaw of the vehicle.
-                # Each path is of the form [[x_values], [y_values],
-                # [theta_values]], where each of x_values, y_values, and
-                # theta_values are in sequential order.
-
-                # Thus, we need to compute:
-                # circle_x = point_x + circle_offset*cos(yaw)
-                # circle_y = point_y circle_offset*sin(yaw)
-                # for each point along the path.
-                # point_x is given by path[0][j], and point _y is given by
-                # path[1][j]. 
-                circle_locations = np.zeros((len(self._circle_offsets), 2))
-
-                circle_offset = np.array(self._circle_offsets)
-                circle_locations[:, 0] = path[0][j] + circle_offset * cos(path[2][j])
-                circle_locations[:, 1] = path[1][j] + circle_offset * sin(path[2][j])
-
-                # Assumes each obstacle is approximated by a collection of
-                # points of the form [x, y].
-                # Here, we will iterate through the obstacle points, and check
-                # if any of the obstacle points lies within any of our circles.
-                # If so, then the path will collide with an obstacle and
-                # the collision_free flag should be set to false for this flag
-                collision_dists = \
-                        scipy.spatial.distance.cdist(obstacles, 
-                                                     circle_locations)
-                collision_dists = np.subtract(collision_dists, 
-                                                  self._circle_radii)
-                collision_free = collision_free and \
-                                     not np.any(collision_dists < 0)
-                if not collision_free:
-                    break
-
-            collision_check_array[i] = collision_free
-
-        return collision_check_array
+        return self.check_circles(paths, obstacles, self._circle_offsets,
+                                  self._circle_radii)
 
     def collision_check_pedestrian(self, paths, obstacles):
         """Returns a bool array on whether each path is collision free.
@@ -111,6 +234,8 @@ class CollisionChecker:
                          ...,
                          [xn, yn]]
                 , where n is the number of obstacle points and units are [m, m]
+                An ObstacleIndex built over these points can be given instead,
+                to replace the dense distance computation by radius queries.
 
         returns:
             collision_check_array: A list of boolean values which classifies
@@ -119,58 +244,224 @@ class CollisionChecker:
                 ith path in the paths list.
         """
 
-        collision_check_array = np.zeros(len(paths), dtype=bool)
+        return self.check_circles(paths, obstacles,
+                                  self._circle_offsets_pedestrian,
+                                  self._circle_radii_pedestrian)
 
-        for i in range(len(paths)):
-            collision_free = True
-            path = paths[i]
-
-            # Iterate over the points in the path.
-            for j in range(len(path[0])):
-                # Compute the circle locations along this point in the path.
-                # These circle represent an approximate collision
-                # border for the vehicle, which will be used to check
-                # for any potential collisions along each path with obstacles.
-
-                # The circle offsets are given by self._circle_offsets.
-                # The circle offsets need to placed at each point along the path,
-                # with the offset rotated by the yaw of the vehicle.
-                # Each path is of the form [[x_values], [y_values],
-                # [theta_values]], where each of x_values, y_values, and
-                # theta_values are in sequential order.
-
-                # Thus, we need to compute:
-                # circle_x = point_x + circle_offset*cos(yaw)
-                # circle_y = point_y circle_offset*sin(yaw)
-                # for each point along the path.
-                # point_x is given by path[0][j], and point _y is given by
-                # path[1][j].
-                circle_locations = np.zeros((len(self._circle_offsets_pedestrian), 2))
-
-                circle_offset = np.array(self._circle_offsets_pedestrian)
-                circle_locations[:, 0] = path[0][j] + circle_offset * cos(path[2][j])
-                circle_locations[:, 1] = path[1][j] + circle_offset * sin(path[2][j])
-
-                # Assumes each obstacle is approximated by a collection of
-                # points of the form [x, y].
-                # Here, we will iterate through the obstacle points, and check
-                # if any of the obstacle points lies within any of our circles.
-                # If so, then the path will collide with an obstacle and
-                # the collision_free flag should be set to false for this flag
-                collision_dists = \
-                    scipy.spatial.distance.cdist(obstacles,
-                                                 circle_locations)
-                collision_dists = np.subtract(collision_dists,
-                                              self._circle_radii_pedestrian)
-                collision_free = collision_free and \
-                                 not np.any(collision_dists < 0)
-                if not collision_free:
-                    break
-
-            collision_check_array[i] = collision_free
+    # Registers the collision circles to use against a class of obstacles,
+    # e.g. cyclists or static props.
+    def add_obstacle_class(self, name, circle_offsets, circle_radii):
+        """Adds (or replaces) an obstacle class for collision_check_classes.
+
+        args:
+            name: Name of the obstacle class.
+            circle_offsets: List of offsets (m) of the collision circles along
+                the heading of the vehicle, used against this class.
+            circle_radii: List of radii (m) of these collision circles.
+        """
+        self._obstacle_classes[name] = (circle_offsets, circle_radii)
+
+    # Takes in a set of paths and a set of obstacles for each obstacle class,
+    # and returns whether or not each path is collision free with respect to
+    # each class, walking the paths only once.
+    def collision_check_classes(self, paths, obstacle_sets, path_times=None):
+        """Returns a bool matrix on whether each path is collision free with
+        respect to each obstacle class.
+
+        args:
+            paths: A list of paths in the global frame, in the same format as
+                for collision_check.
+            obstacle_sets: Dictionary from obstacle class name ('car',
+                'pedestrian' or any class given to add_obstacle_class) to the
+                obstacle points of that class, in the same format as for
+                collision_check (or an ObstacleIndex built over them), or to
+                an ObstaclePrediction of the obstacles of that class.
+            path_times: Array of shape (paths, points) with the time (s) at
+                which the ego vehicle reaches each path point (see
+                path_point_times). Required by the classes whose obstacles
+                are given as an ObstaclePrediction, which are then checked
+                in space and time.
+        returns:
+            collision_check_matrix: Array of shape (classes, paths), whose
+                ith row is the collision_check_array of the ith class of
+                obstacle_sets (in its iteration order).
+        """
+        collision_check_matrix = np.ones((len(obstacle_sets), len(paths)),
+                                         dtype=bool)
+        if len(paths) == 0:
+            return collision_check_matrix
+
+        # The circles of every class are placed along the paths together, and
+        # each class then checks its own slice of circles.
+        circle_sets = [self._obstacle_classes[name] for name in obstacle_sets]
+        offsets = np.concatenate([np.asarray(offsets, dtype=float)
+                                  for offsets, _ in circle_sets])
+        circles = circles_from_poses(path_poses(paths), offsets)
+
+        start = 0
+        for i, obstacles in enumerate(obstacle_sets.values()):
+            circle_radii = circle_sets[i][1]
+            end = start + len(circle_radii)
+            collision_check_matrix[i] = self._check_circle_set(
+                circles[:, :, start:end], obstacles, circle_radii, path_times)
+            start = end
+
+        return collision_check_matrix
+
+    # Checks the collision circles of every point of every path against all
+    # of the obstacle points at once, and returns an array of bools that says
+    # whether or not each path is collision free.
+    def check_circles(self, paths, obstacles, circle_offsets, circle_radii):
+        """Returns a bool array on whether each path is collision free.
+
+        args:
+            paths: A list of paths in the global frame, in the same format as
+                for collision_check.
+            obstacles: A list of [x, y] points that represent points along the
+                border of obstacles, in the global frame, in the same format
+                as for collision_check, or an ObstacleIndex built over them.
+            circle_offsets: List of offsets (m) of the collision circles along
+                the heading of the vehicle.
+            circle_radii: List of radii (m) of the collision circles.
+        returns:
+            collision_check_array: A list of boolean values which classifies
+                whether the path is collision-free (true), or not (false). The
+                ith index in the collision_check_array list corresponds to the
+                ith path in the paths list.
+        """
+        if len(paths) == 0:
+            return np.ones(0, dtype=bool)
+        return self._check_circle_set(circle_locations(paths, circle_offsets),
+                                      obstacles, circle_radii)
+
+    # Checks a set of circle locations against the obstacles, with the broad
+    # phase first and the narrow phase on the remaining path-obstacle pairs.
+    def _check_circle_set(self, circles, obstacles, circle_radii,
+                          path_times=None):
+        if not isinstance(obstacles, (ObstacleIndex, ObstaclePrediction)):
+            obstacles = np.asarray(obstacles, dtype=float).reshape(-1, 2)
+        collision_check_array = np.ones(len(circles), dtype=bool)
+        if len(obstacles) == 0:
+            return collision_check_array
+
+        radii = np.asarray(circle_radii, dtype=float)
+
+        # Broad phase: an obstacle can only hit a path if its bounding box
+        # overlaps the bounding box of the path's circles, inflated by the
+        # largest circle radius. Only these pairs reach the narrow phase.
+        if isinstance(obstacles, ObstaclePrediction):
+            points, boxes = None, obstacles.boxes
+        elif isinstance(obstacles, ObstacleIndex):
+            points, boxes = obstacles.points, obstacles.boxes
+        else:
+            points = obstacles
+            boxes = obstacle_boxes(points, OBSTACLE_BORDER_POINTS)
+        pairs = boxes_overlap(path_boxes(circles, np.max(radii)), boxes)
+        candidates = np.any(pairs, axis=1)
+        self._update_pruning_stats(pairs, candidates)
+        if not np.any(candidates):
+            return collision_check_array
+
+        if isinstance(obstacles, ObstaclePrediction):
+            collision_check_array[candidates] = self._check_prediction(
+                circles[candidates], np.asarray(path_times)[candidates],
+                obstacles, pairs[candidates], radii)
+            return collision_check_array
+
+        if isinstance(obstacles, ObstacleIndex):
+            # Narrow phase as radius queries: a circle collides if the closest
+            # obstacle point is within its radius, and points further than
+            # the largest radius are never visited.
+            path_circles = circles[candidates]
+            distances = obstacles.nearest_distances(path_circles.reshape(-1, 2),
+                                                    np.max(radii))
+            collisions = distances.reshape(path_circles.shape[:3]) < radii
+            collision_check_array[candidates] = ~np.any(collisions, axis=(1, 2))
+            return collision_check_array
+
+        # Narrow phase against the points of the overlapping obstacles only.
+        # A path collides if any of these points lies within any of the
+        # circles placed along it, i.e. if the squared distance from the
+        # point to the circle centre is smaller than the squared radius.
+        # The NaN padding of the shorter paths never collides.
+        radii_sq = np.square(radii)
+        groups = points.reshape(len(boxes), -1, 2)
+        for i in np.flatnonzero(candidates):
+            collision_dists = \
+                scipy.spatial.distance.cdist(circles[i].reshape(-1, 2),
+                                             groups[pairs[i]].reshape(-1, 2),
+                                             'sqeuclidean')
+            collision_dists = collision_dists.reshape(circles.shape[1],
+                                                      circles.shape[2], -1)
+            collision_check_array[i] = \
+                not np.any(collision_dists < radii_sq[:, None])
 
         return collision_check_array
 
+    # Checks the circles along each path against the predicted obstacle
+    # border points at the time the ego vehicle reaches each path point.
+    def _check_prediction(self, circles, path_times, prediction, pairs, radii):
+        radii_sq = np.square(radii)
+        num_times = len(prediction.borders)
+        collision_free = np.ones(len(circles), dtype=bool)
+        for i in range(len(circles)):
+            # Only the path points whose circles reach the swept box of one
+            # of the path's candidate obstacles can collide.
+            near = np.all(np.isfinite(circles[i][:, :, 0]), axis=1)
+            point_circles = circles[i][near]
+            point_boxes = np.hstack((point_circles.min(axis=1) - np.max(radii),
+                                     point_circles.max(axis=1) + np.max(radii)))
+            near[near] = np.any(boxes_overlap(point_boxes,
+                                              prediction.boxes[pairs[i]]), axis=1)
+            if not np.any(near):
+                continue
+
+            # Predicted border points of the candidate obstacles around the
+            # time of each remaining path point, of shape
+            # (points, window, obstacles, border points, 2). The windows of
+            # the earlier points are padded by repeating their last sample.
+            times = np.nan_to_num(path_times[i][near])
+            indices = prediction.time_indices(times)
+            half_widths = PREDICTION_TIME_WINDOW + np.ceil(
+                PREDICTION_TIME_UNCERTAINTY*times/prediction.time_step).astype(int)
+            window = np.arange(-np.max(half_widths), np.max(half_widths) + 1)
+            indices = np.clip(indices[:, None] + window,
+                              indices[:, None] - half_widths[:, None],
+                              indices[:, None] + half_widths[:, None])
+            indices = np.clip(indices, 0, num_times - 1)
+            borders = prediction.borders[indices][:, :, pairs[i]]
+            borders = borders.reshape(len(indices), 1, -1, 2)
+
+            collision_dists = np.sum(np.square(
+                circles[i][near][:, :, None, :] - borders), axis=-1)
+            collision_free[i] = not np.any(collision_dists < radii_sq[:, None])
+        return collision_free
+
+    # Accumulates how many path-obstacle pairs and paths the broad phase
+    # rejected.
+    def _update_pruning_stats(self, pairs, candidates):
+        stats = self._pruning_stats
+        stats['checks'] += 1
+        stats['pairs'] += pairs.size
+        stats['pruned_pairs'] += int(pairs.size - np.count_nonzero(pairs))
+        stats['paths'] += len(candidates)
+        stats['pruned_paths'] += int(len(candidates) - np.count_nonzero(candidates))
+
+    def get_pruning_stats(self):
+        """Returns the broad phase pruning statistics so far.
+
+        returns:
+            stats: Dictionary with the number of collision checks, the number
+                of path-obstacle pairs and paths seen by the broad phase, how
+                many of them it pruned, and the corresponding pruning ratios.
+        """
+        stats = dict(self._pruning_stats)
+        stats['pair_pruning_ratio'] = \
+            stats['pruned_pairs'] / stats['pairs'] if stats['pairs'] > 0 else 0.0
+        stats['path_pruning_ratio'] = \
+            stats['pruned_paths'] / stats['paths'] if stats['paths'] > 0 else 0.0
+        return stats
+
     # Selects the best path in the path set, according to how closely
     # it follows the lane centerline, and how far away it is from other
     # paths that are in collision. 
@@ -296,4 +587,151 @@ class CollisionChecker:
                 best_score = score
                 best_index = i
 
-        return best_index
\ No newline at end of file
+        return best_index
+
+# Computes the circle locations along every point of every path.
+def circle_locations(paths, circle_offsets):
+    """Returns the collision circle centres of all of the paths.
+
+    The circles are placed at each point along the path, with their offset
+    rotated by the yaw of the vehicle at that point:
+        circle_x = point_x + circle_offset*cos(yaw)
+        circle_y = point_y + circle_offset*sin(yaw)
+
+    args:
+        paths: A list of paths in the global frame, in the format
+            [x_points, y_points, t_points]. Only the first len(x_points)
+            yaw values of each path are used.
+        circle_offsets: List of offsets (m) of the collision circles along
+            the heading of the vehicle.
+    returns:
+        circles: Array of shape (paths, points, circles, 2) holding the [x, y]
+            centre of each circle. Paths shorter than the longest one are
+            padded with NaN.
+    """
+    return circles_from_poses(path_poses(paths), circle_offsets)
+
+# Gathers the points of every path into a single array.
+def path_poses(paths):
+    """Returns the [x, y, yaw] poses along every path as one array.
+
+    args:
+        paths: A list of paths in the global frame, in the format
+            [x_points, y_points, t_points]. Only the first len(x_points)
+            yaw values of each path are used.
+    returns:
+        poses: Array of shape (paths, points, 3). Paths shorter than the
+            longest one are padded with NaN.
+    """
+    num_points = max(len(path[0]) for path in paths)
+    poses = np.full((len(paths), num_points, 3), np.nan)
+    for i, path in enumerate(paths):
+        n = len(path[0])
+        poses[i, :n, 0] = path[0]
+        poses[i, :n, 1] = path[1]
+        poses[i, :n, 2] = path[2][:n]
+    return poses
+
+def path_segment_lengths(paths, poses):
+    """Returns the distances between consecutive points of every path, of
+    shape (paths, points - 1), NaN past the end of the shorter paths. The
+    cached segment lengths of PlannedPaths are used instead of the poses.
+    """
+    if not all(isinstance(path, PlannedPath) for path in paths):
+        return np.hypot(np.diff(poses[:, :, 0], axis=1), np.diff(poses[:, :, 1], axis=1))
+    ds = np.full((len(paths), poses.shape[1] - 1), np.nan)
+    for i, path in enumerate(paths):
+        ds[i, :len(path.segment_length)] = path.segment_length
+    return ds
+
+def circles_from_poses(poses, circle_offsets):
+    """Returns the circle centres of shape (paths, points, circles, 2) placed
+    along the poses returned by path_poses.
+    """
+    circle_offsets = np.asarray(circle_offsets, dtype=float)
+    yaws = poses[:, :, 2:3]
+    circles = np.empty(poses.shape[:2] + (len(circle_offsets), 2))
+    circles[..., 0] = poses[:, :, 0:1] + circle_offsets*np.cos(yaws)
+    circles[..., 1] = poses[:, :, 1:2] + circle_offsets*np.sin(yaws)
+    return circles
+
+# Computes the axis-aligned bounding box of every obstacle.
+def obstacle_boxes(points, points_per_obstacle):
+    """Returns the bounding boxes of groups of consecutive obstacle points.
+
+    args:
+        points: Array of [x, y] obstacle border points, of shape (n, 2).
+        points_per_obstacle: Number of consecutive points per obstacle. If n
+            is not a multiple of it, every point gets its own box.
+    returns:
+        boxes: Array of [x_min, y_min, x_max, y_max] boxes, one per obstacle.
+            The ith box bounds points[i*k:(i+1)*k], k being the group size.
+    """
+    if points_per_obstacle < 1 or len(points) % points_per_obstacle != 0:
+        points_per_obstacle = 1
+    groups = points.reshape(-1, points_per_obstacle, 2)
+    return np.hstack((groups.min(axis=1), groups.max(axis=1)))
+
+# Computes the axis-aligned bounding box of the circles of every path.
+def path_boxes(circles, radius):
+    """Returns the bounding boxes of the circles along each path.
+
+    args:
+        circles: Array of circle centres of shape (paths, points, circles, 2),
+            as returned by circle_locations.
+        radius: Largest circle radius (m), by which the boxes are inflated.
+    returns:
+        boxes: Array of [x_min, y_min, x_max, y_max] boxes, one per path.
+    """
+    centres = circles.reshape(len(circles), -1, 2)
+    return np.hstack((np.nanmin(centres, axis=1) - radius,
+                      np.nanmax(centres, axis=1) + radius))
+
+def boxes_overlap(boxes_a, boxes_b):
+    """Returns the (a, b) matrix of which boxes of boxes_a overlap which boxes
+    of boxes_b, both given as [x_min, y_min, x_max, y_max] rows.
+    """
+    return (boxes_a[:, None, 0] <= boxes_b[None, :, 2]) & \
+           (boxes_b[None, :, 0] <= boxes_a[:, None, 2]) & \
+           (boxes_a[:, None, 1] <= boxes_b[None, :, 3]) & \
+           (boxes_b[None, :, 1] <= boxes_a[:, None, 3])
+
+# Computes the time at which the ego vehicle reaches each point of each path.
+def path_point_times(paths, speeds, min_speed=MIN_PATH_SPEED):
+    """Returns the time to reach each path point along its path.
+
+    args:
+        paths: A list of paths in the global frame, in the format
+            [x_points, y_points, t_points].
+        speeds: Speed (m/s) along the paths, either a single speed for all of
+            them or one speed profile per path, given for each of its points
+            (e.g. from the velocity planner).
+        min_speed: Lowest speed (m/s) used to integrate the times.
+    returns:
+        times: Array of shape (paths, points) with the time (s) at which each
+            point is reached, starting from 0 at the first point. Paths
+            shorter than the longest one are padded with NaN.
+    """
+    if len(paths) == 0:
+        return np.zeros((0, 0))
+    poses = path_poses(paths)
+    ds = path_segment_lengths(paths, poses)
+
+    if np.ndim(speeds) == 0:
+        speed = np.full(poses.shape[:2], float(speeds))
+    else:
+        speed = np.full(poses.shape[:2], np.nan)
+        for i, profile in enumerate(speeds):
+            # Profiles shorter than their path hold their last speed.
+            n = min(len(profile), speed.shape[1])
+            speed[i, :n] = profile[:n]
+            if 0 < n < len(paths[i][0]):
+                speed[i, n:len(paths[i][0])] = profile[n - 1]
+    speed = np.maximum(speed, min_speed)
+
+    # Constant acceleration between two points: dt = 2*ds / (v_i + v_i+1).
+    dt = 2.0*ds/(speed[:, :-1] + speed[:, 1:])
+    times = np.zeros(poses.shape[:2])
+    times[:, 1:] = np.cumsum(dt, axis=1)
+    times[np.isnan(poses[:, :, 0])] = np.nan
+    return times
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+import numpy as np
+
+from traffic_light_tracker import NO_TRAFFIC_LIGHT
+
+ALWAYS_DETECT_DISTANCE = 40.0 # m, distance to the next intersection from which the detector runs every tick
+ALWAYS_DETECT_TIME = 4.0      # s, time to the next intersection from which the detector runs every tick
+MAX_DETECTION_PERIOD = 2.0    # s, longest time between two detections far from the intersections
+MIN_SPEED = 0.5               # m/s, lowest speed used to predict the time to the next intersection
+CLOSEST_SEARCH_WINDOW = 20    # waypoints searched ahead of the previous closest waypoint
+
+
+class DetectionScheduler:
+    """Decides on which planner ticks the traffic light detector runs.
+
+    The traffic lights only matter close to the intersections, so the detector
+    runs on every tick when the ego vehicle is within ALWAYS_DETECT_DISTANCE or
+    ALWAYS_DETECT_TIME of the next intersection along the route (or inside of
+    it), and only every MAX_DETECTION_PERIOD seconds otherwise, timed so that
+    it never skips the approach to the intersection. Between two runs, the
+    last detected state is held as the expected state.
+    """
+    def __init__(self, intersection_rectangles, waypoints):
+        """
+        args:
+            intersection_rectangles: [xmin, xmax, ymin, ymax] of each intersection.
+            waypoints: route waypoints, rows of [x, y, v] (global frame).
+        """
+        waypoints = np.asarray(waypoints, dtype=float)
+        self._waypoints = waypoints[:, :2]
+        self._arc_length = np.concatenate(
+            ([0.0], np.cumsum(np.linalg.norm(np.diff(self._waypoints, axis=0), axis=1))))
+
+        # Stretches of the route inside of an intersection, as [start, end] arc lengths.
+        inside = np.zeros(len(waypoints), dtype=bool)
+        for xmin, xmax, ymin, ymax in intersection_rectangles:
+            inside |= (xmin < waypoints[:, 0]) & (waypoints[:, 0] < xmax) & \
+                      (ymin < waypoints[:, 1]) & (waypoints[:, 1] < ymax)
+        edges = np.diff(np.concatenate(([0], inside.astype(int), [0])))
+        self._starts = self._arc_length[np.nonzero(edges == 1)[0]]
+        self._ends = self._arc_length[np.nonzero(edges == -1)[0] - 1]
+
+        self._closest_index = 0
+        self._last_run = None
+        self._expected_state = NO_TRAFFIC_LIGHT
+        self._ticks = 0
+        self._runs = 0
+
+    def distance_to_next_intersection(self, ego_state):
+        """Returns the distance (m) along the route to the next intersection,
+        0 inside of an intersection and inf after the last one."""
+        # Search ahead of the previous closest waypoint, so that the route
+        # does not jump where it passes close to itself.
+        window = slice(self._closest_index, self._closest_index + CLOSEST_SEARCH_WINDOW)
+        distances = np.linalg.norm(self._waypoints[window] - ego_state[:2], axis=1)
+        self._closest_index += int(np.argmin(distances))
+        s = self._arc_length[self._closest_index]
+
+        if np.any((self._starts <= s) & (s <= self._ends)):
+            return 0.0
+        ahead = self._starts[self._starts > s]
+        return ahead[0] - s if len(ahead) > 0 else float('inf')
+
+    def should_detect(self, ego_state, timestamp):
+        """Returns true if the detector has to run on this tick.
+
+        args:
+            ego_state: [ego_x, ego_y, ego_yaw, ego_open_loop_speed]
+            timestamp: simulation time (s) of the tick.
+        """
+        self._ticks += 1
+        distance = self.distance_to_next_intersection(ego_state)
+        speed = max(ego_state[3], MIN_SPEED)
+        always_detect_distance = max(ALWAYS_DETECT_DISTANCE, speed * ALWAYS_DETECT_TIME)
+
+        if distance <= always_detect_distance or self._last_run is None:
+            run = True
+        else:
+            # Run again at the latest when entering the always detect zone.
+            period = min(MAX_DETECTION_PERIOD, (distance - always_detect_distance) / speed)
+            run = timestamp - self._last_run >= period
+
+        if run:
+            self._last_run = timestamp
+            self._runs += 1
+        return run
+
+    def record(self, tl_state):
+        """Records the state detected on a tick where the detector ran."""
+        self._expected_state = tl_state
+
+    @property
+    def expected_state(self):
+        return self._expected_state
+
+    def get_duty_cycle(self):
+        """Returns the share of the ticks on which the detector ran."""
+        return self._runs / max(self._ticks, 1)
+
+    def get_stats(self):
+        return {'ticks': self._ticks, 'runs': self._runs,
+                'duty_cycle': self.get_duty_cycle()}
@@ -4,22 +4,25 @@ import copy
 import path_optimizer
 import collision_checker
 import velocity_planner
+from planned_path import PlannedPath
 from math import sin, cos, pi, sqrt
 
 class LocalPlanner:
     def __init__(self, num_paths, path_offset, circle_offsets, circle_radii, 
                  path_select_weight, time_gap, a_max, slow_speed, 
-                 stop_line_buffer):
+                 stop_line_buffer, spiral_table=None, a_lat_max=None,
+                 unified_profile=False, j_max=None):
         self._num_paths = num_paths
         self._path_offset = path_offset
-        self._path_optimizer = path_optimizer.PathOptimizer()
+        self._path_optimizer = path_optimizer.PathOptimizer(spiral_table)
         self._collision_checker = \
             collision_checker.CollisionChecker(circle_offsets,
                                                circle_radii,
                                                path_select_weight)
         self._velocity_planner = \
             velocity_planner.VelocityPlanner(time_gap, a_max, slow_speed, 
-                                             stop_line_buffer)
+                                             stop_line_buffer, a_lat_max,
+                                             unified_profile, j_max)
         self._prev_best_path = None
 
     ######################################################
@@ -182,12 +185,11 @@ class LocalPlanner:
         """
         paths         = []
         path_validity = []
-        for goal_state in goal_state_set:
-            path = self._path_optimizer.optimize_spiral(goal_state[0], 
-                                                        goal_state[1], 
-                                                        goal_state[2])
-            if np.linalg.norm([path[0][-1] - goal_state[0], 
-                               path[1][-1] - goal_state[1], 
+        # All of the spirals are optimized together in a single batch.
+        spirals = self._path_optimizer.optimize_spirals(goal_state_set)
+        for goal_state, path in zip(goal_state_set, spirals):
+            if np.linalg.norm([path[0][-1] - goal_state[0],
+                               path[1][-1] - goal_state[1],
                                path[2][-1] - goal_state[2]]) > 0.1:
                 path_validity.append(False)
             else:
@@ -217,29 +219,29 @@ def transform_paths(paths, ego_state):
                 ego_yaw             : top-down orientation [-pi to pi]
                 ego_open_loop_speed : open loop speed (m/s)
     returns:
-        transformed_paths: A list of transformed paths in the global frame.  
-            A path is a list of points of the following format:
+        transformed_paths: A list of transformed paths in the global frame, as
+            PlannedPath objects which also hold the arc length and curvature
+            of each path for the later planner stages. They index as paths of
+            the following format:
                 [x_points, y_points, t_points]:
-                    , x_points: List of x values (m)
-                    , y_points: List of y values (m)
-                    , t_points: List of yaw values (rad)
+                    , x_points: Array of x values (m)
+                    , y_points: Array of y values (m)
+                    , t_points: Array of yaw values (rad)
                 Example of accessing the ith transformed path, jth point's 
                 y value:
                     paths[i][1][j]
     """
     transformed_paths = []
+    cos_yaw, sin_yaw = cos(ego_state[2]), sin(ego_state[2])
     for path in paths:
-        x_transformed = []
-        y_transformed = []
-        t_transformed = []
-
-        for i in range(len(path[0])):
-            x_transformed.append(ego_state[0] + path[0][i]*cos(ego_state[2]) - \
-                                                path[1][i]*sin(ego_state[2]))
-            y_transformed.append(ego_state[1] + path[0][i]*sin(ego_state[2]) + \
-                                                path[1][i]*cos(ego_state[2]))
-            t_transformed.append(path[2][i] + ego_state[2])
-
-        transformed_paths.append([x_transformed, y_transformed, t_transformed])
+        x = np.asarray(path[0], dtype=float)
+        y = np.asarray(path[1], dtype=float)
+        t = np.asarray(path[2][:len(x)], dtype=float)
+
+        x_transformed = ego_state[0] + x*cos_yaw - y*sin_yaw
+        y_transformed = ego_state[1] + x*sin_yaw + y*cos_yaw
+        t_transformed = t + ego_state[2]
+
+        transformed_paths.append(PlannedPath(x_transformed, y_transformed, t_transformed))
 
     return transformed_paths
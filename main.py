@@ -9,33 +9,37 @@ import os
 import argparse
 import logging
 import time
+PROCESS_START_TIME = time.time()
 import math
+import threading
 import numpy as np
 import csv
-import matplotlib.pyplot as plt
 from numpy.core.defchararray import index
 import controller2d
 import configparser 
 import local_planner
 import behavioural_planner
-import cv2
+import collision_checker
+import spiral_table
+import traffic_light_detection
+import detection_scheduler
+from traffic_light_tracker import MAX_DEPTH
 import json 
 from math import sin, cos, pi, tan, sqrt, atan2
 
-from carla_detector_model_traffic_light import detect_image, get_model_from_file
-from postprocessing import draw_boxes
 # Script level imports
 sys.path.append(os.path.abspath(sys.path[0] + '/..'))
-import live_plotter as lv   # Custom live plotting library
 from carla            import sensor
 from carla.client     import make_carla_client, VehicleControl
 from carla.settings   import CarlaSettings
 from carla.tcp        import TCPConnectionError
 from carla.controller import utils
 from carla.sensor import Camera
-from carla.image_converter import labels_to_array, depth_to_array, to_bgra_array
+from carla.image_converter import to_bgra_array
 from carla.planner.city_track import CityTrack
 
+IMPORT_TIME = time.time() - PROCESS_START_TIME
+
 
 ###############################################################################
 # CONFIGURABLE PARAMETERS DURING EXAM
@@ -98,6 +102,19 @@ PATH_SELECT_WEIGHT     = 10
 A_MAX                  = 2.5              # m/s^2
 SLOW_SPEED             = 2.0              # m/s
 STOP_LINE_BUFFER       = 3.5              # m
+A_LAT_MAX              = None             # m/s^2 Maximum lateral acceleration,
+                                          # which limits the speed in the turns
+                                          # of the local path, e.g. 2.0 (None
+                                          # to disable, not validated in
+                                          # simulation yet)
+UNIFIED_SPEED_PROFILE  = False            # Plan the minimum time speed profile
+                                          # under all of the speed limits at
+                                          # once (stop line, lead vehicle,
+                                          # emergency stop, turns) instead of
+                                          # one profile per case (not
+                                          # validated in simulation yet)
+J_MAX                  = None             # m/s^3 Maximum jerk when accelerating
+                                          # (None for no limit)
 LEAD_VEHICLE_LOOKAHEAD = 25               # m Treshold at which we stop considering the lead vehicle as an obstacle
 LEAD_VEHICLE_ACTIVATION = 13              # m Treshold at which the velocity planner accept the lead vehicle
 LP_FREQUENCY_DIVISOR   = 2                # Frequency divisor to make the 
@@ -106,6 +123,23 @@ LP_FREQUENCY_DIVISOR   = 2                # Frequency divisor to make the
                                           # (which operates at the simulation
                                           # frequency). Must be a natural
                                           # number.
+USE_SPIRAL_TABLE       = True             # Interpolate the spirals from the
+                                          # precomputed table when it has been
+                                          # built (python spiral_table.py)
+PREDICT_PEDESTRIANS    = False            # Check the paths against the
+                                          # predicted motion of the pedestrians
+                                          # (constant velocity) instead of
+                                          # their current position, in place
+                                          # of the orientation heuristic (not
+                                          # validated in simulation yet)
+SCHEDULE_TL_DETECTION  = True             # Run the traffic light detector on
+                                          # every tick only when approaching an
+                                          # intersection, and seldom otherwise
+ASYNC_TL_DETECTION     = False            # Run the traffic light detector in
+                                          # a background thread on the latest
+                                          # camera frame, instead of inside of
+                                          # the planner tick (not validated in
+                                          # simulation yet)
 
 # Path interpolation parameters
 INTERP_MAX_POINTS_PLOT    = 10   # number of points used for displaying
@@ -113,6 +147,7 @@ INTERP_MAX_POINTS_PLOT    = 10   # number of points used for displaying
 INTERP_DISTANCE_RES       = 0.01 # distance between interpolated points
 
 MAP_OBSTACLE_THRESHOLD =30 # viewing distance of obstacles
+OBSTACLE_BORDER_SAMPLES = 8 # number of points sampled along the border of each obstacle
 
 MAP_ANGLE_THRESHOLD = 25 # angle treshold in which we accept potential lead vehicles or not
 
@@ -134,10 +169,12 @@ camera_parameters['yaw'] = 0
 camera_parameters['pitch'] = 10
 camera_parameters['roll'] = 0
 
-MAX_DEPTH=1000 #default value of traffic light depth
-
-# Model initialization for detector
-model = get_model_from_file()
+TL_DEPTH_PERCENTILE=10 #percentile of the depth of the traffic light pixels taken as the traffic light depth
+TL_ROI_MODE=False #run the detector only on the band of the image where the traffic lights appear, once benchmark_detector.py shows no recall loss against the full frame
+TL_ROI=[0.4, 0.0, 1.0, 0.55] #[xmin, ymin, xmax, ymax] of the band, as fractions of the camera image (upper right)
+TL_BACKEND='keras' #detector inference backend: 'keras' or 'tflite' (TensorFlow Lite)
+TL_QUANTIZE=False #run the int8 quantized TensorFlow Lite model
+TL_PREWARM=True #load the detector in the background while the episode is loading, instead of on the first detection
 
 def rotate_x(angle):
     R = np.mat([[ 1,         0,           0],
@@ -175,115 +212,161 @@ def to_rot(r):
 
 # Transform the obstacle with its boundary point in the global frame
 def obstacle_to_world(location, dimensions, orientation):
-    box_pts = []
-
-    x = location.x
-    y = location.y
-    z = location.z
-
-    yaw = orientation.yaw * pi / 180
-
-    xrad = dimensions.x
-    yrad = dimensions.y
-    zrad = dimensions.z
-
-    # Border points in the obstacle frame
-    cpos = np.array([
-            [-xrad, -xrad, -xrad, 0,    xrad, xrad, xrad,  0    ],
-            [-yrad, 0,     yrad,  yrad, yrad, 0,    -yrad, -yrad]])
-    
-    # Rotation of the obstacle
-    rotyaw = np.array([
-            [np.cos(yaw), np.sin(yaw)],
-            [-np.sin(yaw), np.cos(yaw)]])
-    
-    # Location of the obstacle in the world frame
-    cpos_shift = np.array([
-            [x, x, x, x, x, x, x, x],
-            [y, y, y, y, y, y, y, y]])
-    
-    cpos = np.add(np.matmul(rotyaw, cpos), cpos_shift)
+    box_pts = obstacles_to_world([[location.x, location.y]],
+                                 [[dimensions.x, dimensions.y]],
+                                 [orientation.yaw * pi / 180])[0]
+    return box_pts.tolist()
+
+# Border points of a box in its own frame, in units of its extents, sampled
+# evenly around its perimeter starting from the (-1, -1) corner. With 8 samples
+# these are the 4 corners and the 4 side midpoints.
+def border_template(num_samples):
+    u = np.arange(num_samples) * 8.0 / num_samples
+    side = np.floor(u / 2.0)
+    t = u - 2.0 * side - 1.0
+    x = np.select([side == 0, side == 1, side == 2], [-1.0, t, 1.0], -t)
+    y = np.select([side == 0, side == 1, side == 2], [t, 1.0, -t], -1.0)
+    return np.array([x, y])
+
+# Transform a set of obstacles with their boundary points in the global frame
+def obstacles_to_world(locations, extents, yaws, num_samples=OBSTACLE_BORDER_SAMPLES, out=None):
+    '''
+    Batched version of obstacle_to_world for N obstacles given as arrays of [x, y] locations (m), [x, y] extents (m)
+    and yaws (rad). Returns the (N, num_samples, 2) array of the [x, y] border points of each obstacle, written in
+    out if given.
+    '''
+    locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+    extents = np.asarray(extents, dtype=float).reshape(-1, 2)
+    yaws = np.asarray(yaws, dtype=float).reshape(-1, 1)
+    if out is None:
+        out = np.empty((len(locations), num_samples, 2))
+
+    # Border points in the obstacle frame, rotated and moved in the world frame.
+    cpos = border_template(num_samples)
+    cx = extents[:, 0:1] * cpos[0]
+    cy = extents[:, 1:2] * cpos[1]
+    cos_yaw = np.cos(yaws)
+    sin_yaw = np.sin(yaws)
+    out[:, :, 0] = locations[:, 0:1] + cos_yaw * cx + sin_yaw * cy
+    out[:, :, 1] = locations[:, 1:2] - sin_yaw * cx + cos_yaw * cy
+    return out
+
+class DetectorModel(object):
+    """ Detector Model Class
+
+    Imports the detector (Keras/TensorFlow) and loads its model on first use,
+    instead of at import time. prewarm() does it in a background thread, so
+    that the model is ready by the time the episode has loaded.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._detector = None
+        self._model = None
+        self._input_size = None
+        self.load_time = None
+        self.prewarmed = False
+
+    def prewarm(self):
+        self.prewarmed = True
+        threading.Thread(target=self.get, name='detector_prewarm', daemon=True).start()
+
+    def get(self):
+        '''
+        Return the detector module, the model and its (width, height) input size, with the input size matching the
+        region of interest in ROI mode. Blocks until the model is loaded.
+        '''
+        with self._lock:
+            if self._model is None:
+                start = time.time()
+                import carla_detector_model_traffic_light as detector
+                if TL_ROI_MODE:
+                    input_size = detector.roi_input_size(TL_ROI, camera_parameters['width'], camera_parameters['height'])
+                else:
+                    input_size = detector.image_size
+                model = detector.get_model_from_file(input_size, TL_BACKEND, TL_QUANTIZE)
+                #run a first prediction, which builds the runtime state of the backend
+                detector.predict_with_model_from_image(model, np.zeros((1, input_size[1], input_size[0], 3)))
+                self._detector, self._input_size = detector, input_size
+                self._model = model
+                self.load_time = time.time() - start
+        return self._detector, self._model, self._input_size
+
+# Model initialization for detector, deferred until it is used
+detector_model = DetectorModel()
+
+def detect_traffic_light(image_BGR):
+    '''
+    Run the detector on a BGRA camera image and return the label of the traffic light and its bounding box, enlarged
+    by a fixed percentage. In ROI mode only the TL_ROI band is fed to the detector, and the bounding box is mapped
+    back to the full image.
+    label ---->  [0,1,2] = [GO,STOP,NO_TRAFFIC_LIGHT]
+    '''
+    detector, model, input_size = detector_model.get()
+    roi = TL_ROI if TL_ROI_MODE else None
+    image_RGB = detector.preprocess_image(image_BGR, input_size, roi)
+    netout = detector.predict_with_model_from_image(model, image_RGB) #perform object detection
+    if roi is not None:
+        netout = detector.roi_boxes_to_image(netout, roi)
+    percentage=0.03 #percentage used to increase the bounding box
+    for box in netout:
+        label=box.get_label()
+        #enlarge the bounding box of the fixed percentage
+        box.xmin-=box.xmin*percentage
+        box.ymin-=box.ymin*percentage
+        box.xmax+=box.xmax*percentage
+        box.ymax+=box.ymax*percentage
+        return label,box
+    return 2,None
+
+def show_traffic_light(image_BGR, box):
+    '''
+    Draw the bounding box of the traffic light, if any, on the camera image and show it. OpenCV is only imported
+    here, the first time an image is shown, to keep it out of the startup time.
+    '''
+    import cv2
+    from postprocessing import draw_boxes
 
-    for j in range(cpos.shape[1]):
-        box_pts.append([cpos[0,j], cpos[1,j]])
-    
-    return box_pts
+    plt_image=image_BGR
+    if box is not None:
+        plt_image=draw_boxes(image_BGR.copy(),[box],["go", "stop"])  #draw enlarged bounding box in image and show it
+    cv2.imshow("BGRA_IMAGE", plt_image)
+    cv2.waitKey(1)
 
 def check_for_traffic_light(sensor_data):
     '''
     Check if there is a traffic light and return its label and the associated bounding box.
     label ---->  [0,1,2] = [GO,STOP,NO_TRAFFIC_LIGHT]
     '''
-    showing_dims=(416,416)
     if sensor_data.get("CameraRGB", None) is not None:
         # Camera BGR data
         image_BGR = to_bgra_array(sensor_data["CameraRGB"])
-        image_BGR2=image_BGR.copy()
-        image_RGB = cv2.cvtColor(image_BGR, cv2.COLOR_BGR2RGB)
-        image_RGB = cv2.resize(image_RGB, showing_dims)
-        image_RGB = image_RGB / 255
-        image_RGB = np.expand_dims(image_RGB, 0)
-        _, netout = detect_image(image_RGB, image_BGR2, model) #perform object detection
-        plt_image=image_BGR
-        percentage=0.03 #percentage used to increase the bounding box
-        for box in netout:
-            label=box.get_label()
-            #enlarge the bounding box of the fixed percentage
-            box.xmin-=box.xmin*percentage
-            box.ymin-=box.ymin*percentage
-            box.xmax+=box.xmax*percentage
-            box.ymax+=box.ymax*percentage
-
-            plt_image=draw_boxes(image_BGR,[box],["go", "stop"])  #draw enlarged bounding box in image and show it
-            cv2.imshow("BGRA_IMAGE", plt_image)
-            cv2.waitKey(1)
-
-            return label,box
-
-        cv2.imshow("BGRA_IMAGE", plt_image)
-        cv2.waitKey(1)
-        return 2,None
+        label, box = detect_traffic_light(image_BGR)
+        show_traffic_light(image_BGR, box)
+        return label, box
 
 
 def compute_depth_tl(segmentation_data, depth_data, tl_box):
     '''
     Take the bounding box to check if there is a traffic light within, using a segmentation camera. If it is inside, compute
-    the depth between the camera and  the traffic light.
+    the depth between the camera and  the traffic light, as a low percentile (TL_DEPTH_PERCENTILE) of the depth of its pixels.
+    Only the pixels inside the bounding box are decoded from the segmentation and depth images.
     '''
-    segmentation_data = labels_to_array(segmentation_data)
     #resize the bounding box according to the camera parameters and perform correction if the bounding box is outside of the image.
-    top_left_point, bottom_right_point = (tl_box.xmin, tl_box.ymin), (tl_box.xmax, tl_box.ymax)
-    top_left_x = int(top_left_point[0] * 416)
-    bottom_right_x = int(bottom_right_point[0] * 416)
-    top_left_y = int(top_left_point[1] * 416)
-    bottom_right_y = int(bottom_right_point[1] * 416)
     image_w,image_h=camera_parameters['width'],camera_parameters['height']
-    if (top_left_x > image_w ): top_left_x = image_w
-    if (bottom_right_x > image_w): bottom_right_x = image_w
-    if (top_left_y > image_h): top_left_y = image_h
-    if ( bottom_right_y > image_h):  bottom_right_y = image_h
-    if (top_left_x < 0 ): top_left_x = 0
-    if (bottom_right_x < 0): bottom_right_x = 0
-    if (top_left_y < 0): top_left_y = 0
-    if ( bottom_right_y < 0):  bottom_right_y = 0
-
-    #check if the bounding box contains the traffic light
-    found_tl=False
-    for i in range(top_left_x, bottom_right_x):
-        for j in range(top_left_y, bottom_right_y):
-            if segmentation_data[j][i] == 12:
-                found_tl=True
-                break
-        if segmentation_data[j][i] == 12:
-            break
+    top_left_x, bottom_right_x = np.clip([int(tl_box.xmin * image_w), int(tl_box.xmax * image_w)], 0, image_w)
+    top_left_y, bottom_right_y = np.clip([int(tl_box.ymin * image_h), int(tl_box.ymax * image_h)], 0, image_h)
 
-    #compute the depth on the [j,1] pixel
-    depth_data = depth_to_array(depth_data)
-    if found_tl:
-        tl_depth = depth_data[j][i] * 1000  # Consider depth in meters
-    else:
-        tl_depth=1000
-    return tl_depth
+    #check which pixels of the bounding box belong to the traffic light (red channel of the segmentation image)
+    segmentation_box = to_bgra_array(segmentation_data)[top_left_y:bottom_right_y, top_left_x:bottom_right_x, 2]
+    tl_pixels = segmentation_box == 12
+    if not np.any(tl_pixels):
+        return MAX_DEPTH
+
+    #decode the depth of the traffic light pixels only: (R + G * 256 + B * 256 * 256) / (256 * 256 * 256 - 1)
+    depth_box = to_bgra_array(depth_data)[top_left_y:bottom_right_y, top_left_x:bottom_right_x]
+    tl_bgra = depth_box[tl_pixels][:, :3].astype(np.float64)
+    tl_depths = np.dot(tl_bgra, [65536.0, 256.0, 1.0]) / 16777215.0 * 1000  # Consider depth in meters
+    return np.percentile(tl_depths, TL_DEPTH_PERCENTILE)
 
 def emergency_break_pedestrian(ego_state, x_history, y_history, measurement_data, pedestrians_info, bp):
     '''
@@ -373,19 +456,99 @@ def check_collision_intersections(bp, cars_collision, in_intersection, percentag
         if cnt_collided_path >= len(cars_collision) * percentage:
             bp._handbrake = True
 
-def update_obstacles(bp, measurement_data,current_x,current_y,ego_state):
+class ObstacleBuffers(object):
+    """ Obstacle Buffers Class
+
+    Fixed capacity arrays, sized from NUM_VEHICLES and NUM_PEDESTRIANS, that
+    collect the cars and pedestrians of a frame and are reused from one frame
+    to the next. The agents of both classes share one buffer, each class from
+    its own offset, and the border points of all of the collected obstacles
+    are written into one preallocated buffer, handed back as views for each
+    class.
+    """
+    CLASSES = ('car', 'pedestrian')
+
+    def __init__(self, num_vehicles, num_pedestrians, num_samples=OBSTACLE_BORDER_SAMPLES):
+        self._capacity = {'car': max(num_vehicles, 1), 'pedestrian': max(num_pedestrians, 1)}
+        self._counts = {'car': 0, 'pedestrian': 0}
+        self._allocate(num_samples)
+
+    def _allocate(self, num_samples):
+        # Rows of [x, y, x extent, y extent, yaw], the cars first, then the pedestrians.
+        self._offsets = {}
+        offset = 0
+        for agent_class in self.CLASSES:
+            self._offsets[agent_class] = offset
+            offset += self._capacity[agent_class]
+        self._agents = np.empty((offset, 5))
+        self._borders = np.empty((offset, num_samples, 2))
+
+    def clear(self):
+        self._counts['car'] = 0
+        self._counts['pedestrian'] = 0
+
+    def add(self, agent_class, location, dimensions, orientation):
+        count = self._counts[agent_class]
+        if count == self._capacity[agent_class]:
+            self._grow(agent_class)
+        row = self._agents[self._offsets[agent_class] + count]
+        row[0] = location.x
+        row[1] = location.y
+        row[2] = dimensions.x
+        row[3] = dimensions.y
+        row[4] = orientation.yaw * pi / 180
+        self._counts[agent_class] = count + 1
+
+    def _grow(self, agent_class):
+        # More agents than expected, double the capacity of the class and move
+        # the collected agents to their new offsets.
+        agents, offsets = self._agents, self._offsets
+        self._capacity[agent_class] *= 2
+        self._allocate(self._borders.shape[1])
+        for name in self.CLASSES:
+            count = self._counts[name]
+            self._agents[self._offsets[name]:self._offsets[name] + count] = \
+                agents[offsets[name]:offsets[name] + count]
+
+    def _class_agents(self, agent_class):
+        offset = self._offsets[agent_class]
+        return self._agents[offset:offset + self._counts[agent_class]]
+
+    def borders(self):
+        """Computes the border points of all of the collected obstacles.
+
+        Returns:
+            (obstacles, cars, pedestrians): Arrays of [x, y] border points
+                (views of the same buffer) of all of the obstacles, of the
+                cars only and of the pedestrians only.
+        """
+        num_cars = self._counts['car']
+        num_pedestrians = self._counts['pedestrian']
+        borders = self._borders[:num_cars + num_pedestrians]
+
+        # The border points of each class are written next to each other.
+        for agents, out in ((self._class_agents('car'), borders[:num_cars]),
+                            (self._class_agents('pedestrian'), borders[num_cars:])):
+            obstacles_to_world(agents[:, 0:2], agents[:, 2:4], agents[:, 4],
+                               borders.shape[1], out=out)
+
+        return (borders.reshape(-1, 2),
+                borders[:num_cars].reshape(-1, 2),
+                borders[num_cars:].reshape(-1, 2))
+
+def update_obstacles(bp, measurement_data,current_x,current_y,ego_state,buffers):
     '''
     Update all the data of the dynamic obstacles around the ego-vehicle, i.e. orientation and position.
     If a vehicle has its orientation in parallel to that of the ego-vehicle it is considered as a potential lead_vehicle and
     in particular if its distance is less at 10 meters, then the emergency brake  is activated.
+    The obstacles are collected in the preallocated buffers (ObstacleBuffers), and their border points are computed
+    once for all of them at the end of the frame.
     '''
 
     lead_car_state = []
     bp._follow_lead_vehicle = False
-    obstacles = np.empty((0, 2), dtype=float)
-    pedestrians = np.empty((0, 2), dtype=float)
     pedestrians_info = []
-    cars = np.empty((0, 2), dtype=float)
+    buffers.clear()
     for agent in measurement_data.non_player_agents:
         loc = agent.vehicle.transform.location
         #consider only the agent which are cars and within the square of dimension MAP_OBSTACLE_THRESHOLD around ego_vehicle position
@@ -408,8 +571,7 @@ def update_obstacles(bp, measurement_data,current_x,current_y,ego_state):
                     if dist_lead_car < 10:
                         bp._handbrake = True
             else:
-                obstacles = np.vstack((obstacles, np.array(obstacle_to_world(loc, dim, ori))))
-                cars = np.vstack((cars, np.array(obstacle_to_world(loc, dim, ori))))
+                buffers.add('car', loc, dim, ori)
 
         loc = agent.pedestrian.transform.location
         #consider only the agent which are pedestrians and within the square of dimension MAP_OBSTACLE_THRESHOLD around ego_vehicle position
@@ -418,9 +580,9 @@ def update_obstacles(bp, measurement_data,current_x,current_y,ego_state):
                 current_y - MAP_OBSTACLE_THRESHOLD < loc.y < current_y + MAP_OBSTACLE_THRESHOLD):
             dim = agent.pedestrian.bounding_box.extent
             ori = agent.pedestrian.transform.rotation
-            pedestrians_info.append([loc, ori.yaw * pi / 180])
-            pedestrians = np.vstack((pedestrians, np.array(obstacle_to_world(loc, dim, ori))))
-            obstacles = np.vstack((obstacles, np.array(obstacle_to_world(loc, dim, ori))))
+            pedestrians_info.append([loc, ori.yaw * pi / 180, agent.pedestrian.forward_speed])
+            buffers.add('pedestrian', loc, dim, ori)
+    obstacles, cars, pedestrians = buffers.borders()
     return obstacles, pedestrians_info, pedestrians, cars, lead_car_state
 
 
@@ -440,15 +602,20 @@ def manage_intersection(intersection_rectangles, ego_state,measurement_data):
     return False
 
 
-def predict_pedestrian_collisions(pedestrian_collision_check_array, pedestrians_info, ego_state,DELTA_ORIENTATION):
+def predict_pedestrian_collisions(pedestrian_collision_check_array, pedestrians_info, ego_state,DELTA_ORIENTATION,
+                                  predicted_motion=False):
     '''
     Considering all the paths from the Local Planner, if the pedestrians are noticed on the outermost paths and
     have an orientation with values contained in a certain range of possible values, then the collision is predicted;
     otherwise, if the pedestrians are noticed by the central paths regardless of their orientation,then the collision is predicted.
+    If the collision check already accounted for the motion of the pedestrians (predicted_motion), the orientation
+    heuristic is not needed and a collision on any path is predicted.
     '''
 
     #we use a parallel collision array named is_active_collision to predict the collisions.
-    if len(pedestrian_collision_check_array) >= 3:
+    if predicted_motion:
+        is_active_collision = [True] * len(pedestrian_collision_check_array)
+    elif len(pedestrian_collision_check_array) >= 3:
         is_active_collision = [False] * len(pedestrian_collision_check_array)
         mid = int(len(is_active_collision) / 2)
         is_active_collision[mid], is_active_collision[mid - 1], is_active_collision[mid + 1] = True, True, True
@@ -456,7 +623,7 @@ def predict_pedestrian_collisions(pedestrian_collision_check_array, pedestrians_
         is_active_collision = [True] * len(pedestrian_collision_check_array)
 
     if False in pedestrian_collision_check_array:
-        if len(pedestrian_collision_check_array) >= 3:
+        if not predicted_motion and len(pedestrian_collision_check_array) >= 3:
             for p in pedestrians_info:
                 p_x, p_y, p_ori = p[0].x, p[0].y, p[1]
                 ego_ori = ego_state[2]
@@ -727,11 +894,29 @@ def make_correction(waypoint,previuos_waypoint,desired_speed):
     waypoint_on_lane[2] = desired_speed
 
     return waypoint_on_lane
+def print_startup_report(connect_time, episode_time):
+    '''
+    Print the time spent importing the modules, connecting to the server, starting the episode and loading the
+    detector, and the time from the process start to the first planner tick.
+    '''
+    if detector_model.load_time is None:
+        detector_load = "still loading" if detector_model.prewarmed else "not loaded"
+    else:
+        detector_load = f"{detector_model.load_time:.2f} s ({'in background' if detector_model.prewarmed else 'on first use'})"
+    print(f"STARTUP -> imports : {IMPORT_TIME:.2f} s | connect : {connect_time - IMPORT_TIME:.2f} s | "
+          f"episode start : {episode_time:.2f} s | detector load : {detector_load} | "
+          f"first planner tick : {time.time() - PROCESS_START_TIME:.2f} s")
+
 def exec_waypoint_nav_demo(args):
     """ Executes waypoint navigation demo.
     """
     with make_carla_client(args.host, args.port) as client:
         print('Carla client connected.')
+        connect_time = time.time() - PROCESS_START_TIME
+
+        # Load the detector while the server loads the episode.
+        if TL_PREWARM:
+            detector_model.prewarm()
 
         settings = make_carla_settings(args)
 
@@ -749,7 +934,9 @@ def exec_waypoint_nav_demo(args):
         # player_start index. This function blocks until the server is ready
         # to start the episode.
         print('Starting new episode at %r...' % scene.map_name)
+        episode_start = time.time()
         client.start_episode(player_start)
+        episode_time = time.time() - episode_start
 
         #############################################
         # Load Configurations
@@ -1005,6 +1192,9 @@ def exec_waypoint_nav_demo(args):
         # Uses the live plotter to generate live feedback during the simulation
         # The two feedback includes the trajectory feedback and
         # the controller feedback (which includes the speed tracking).
+        # The live plotter (and matplotlib) is only imported here, once the
+        # episode is set up, to keep it out of the startup time.
+        import live_plotter as lv   # Custom live plotting library
         lp_traj = lv.LivePlotter(tk_title="Trajectory Trace")
         lp_1d = lv.LivePlotter(tk_title="Controls Feedback")
 
@@ -1111,6 +1301,9 @@ def exec_waypoint_nav_demo(args):
         wp_goal_index   = 0
         local_waypoints = None
         path_validity   = np.zeros((NUM_PATHS, 1), dtype=bool)
+        table = None
+        if USE_SPIRAL_TABLE and os.path.exists(spiral_table.SPIRAL_TABLE_FILE):
+            table = spiral_table.SpiralTable()
         lp = local_planner.LocalPlanner(NUM_PATHS,
                                         PATH_OFFSET,
                                         CIRCLE_OFFSETS,
@@ -1119,11 +1312,27 @@ def exec_waypoint_nav_demo(args):
                                         TIME_GAP,
                                         A_MAX,
                                         SLOW_SPEED,
-                                        STOP_LINE_BUFFER)
+                                        STOP_LINE_BUFFER,
+                                        table,
+                                        A_LAT_MAX,
+                                        UNIFIED_SPEED_PROFILE,
+                                        J_MAX)
 
         bp = behavioural_planner.BehaviouralPlanner(BP_LOOKAHEAD_BASE,
                                                     LEAD_VEHICLE_LOOKAHEAD)
 
+        # Reused from frame to frame to collect the obstacles.
+        obstacle_buffers = ObstacleBuffers(NUM_VEHICLES, NUM_PEDESTRIANS)
+
+        # Chooses the planner ticks on which the traffic light detector runs, from the distance to the next intersection.
+        if SCHEDULE_TL_DETECTION:
+            tl_scheduler = detection_scheduler.DetectionScheduler(intersection_rectangles, waypoints)
+
+        # Background traffic light detector, fed with the camera frames by the planner ticks.
+        if ASYNC_TL_DETECTION:
+            tl_detector = traffic_light_detection.TrafficLightDetector(detect_traffic_light).start()
+            tl_consumed_timestamp = None
+
         #############################################
         # Scenario Execution Loop
         #############################################
@@ -1145,6 +1354,9 @@ def exec_waypoint_nav_demo(args):
         # Initialize collision prediction
         predict_collision = False
 
+        # Report the startup times once the first planner tick is done
+        startup_reported = False
+
         for frame in range(TOTAL_EPISODE_FRAMES):
 
             # Gather current data from the CARLA server
@@ -1207,16 +1419,56 @@ def exec_waypoint_nav_demo(args):
 
                 bp.set_lookahead(BP_LOOKAHEAD_BASE + BP_LOOKAHEAD_TIME * open_loop_speed)
 
-                #compute depth and state of traffic light
+                #compute depth and state of traffic light, running the detector only on the ticks chosen by the scheduler
                 tl_depth=MAX_DEPTH
-                tl_state, tl_box = check_for_traffic_light(sensor_data=sensor_data)
-                if tl_state !=2 and segmentation_data is not None:
+                tl_age=0.0
+                tl_fresh=True
+                run_detection = not SCHEDULE_TL_DETECTION or tl_scheduler.should_detect(ego_state, current_timestamp)
+                if not run_detection:
+                    #far from the next intersection: keep the state of the last detection, without a traffic light to locate
+                    tl_state, tl_box = tl_scheduler.expected_state, None
+                elif ASYNC_TL_DETECTION:
+                    #hand the latest frame to the detector and use the most recent detection, whatever frame it comes from,
+                    #once: until the detector finishes a newer frame the planner keeps its traffic light track as it is
+                    camera_data = sensor_data.get("CameraRGB", None)
+                    if camera_data is not None:
+                        image_BGR = to_bgra_array(camera_data)
+                        tl_detector.submit(image_BGR, current_timestamp)
+                    tl_detection = tl_detector.latest(newer_than=tl_consumed_timestamp)
+                    tl_fresh = tl_detection is not None
+                    if tl_fresh:
+                        tl_consumed_timestamp = tl_detection.timestamp
+                        tl_state, tl_box = tl_detection.label, tl_detection.box
+                        tl_age = tl_detection.age(current_timestamp)
+                    else:
+                        tl_state, tl_box = 2, None
+                    if camera_data is not None:
+                        show_traffic_light(image_BGR, tl_box)
+                else:
+                    tl_state, tl_box = check_for_traffic_light(sensor_data=sensor_data)
+                if run_detection and SCHEDULE_TL_DETECTION and tl_fresh:
+                    tl_scheduler.record(tl_state)
+                if tl_state !=2 and tl_box is not None and segmentation_data is not None:
                     tl_depth=compute_depth_tl(segmentation_data,depth_data,tl_box)
                 #perform the BEHAVIOURAL PLANNER state transition
-                bp.transition_state(waypoints, ego_state,tl_depth,tl_state)
+                bp.transition_state(waypoints, ego_state,tl_depth,tl_state,current_timestamp,tl_age,tl_fresh)
+                if not startup_reported:
+                    print_startup_report(connect_time, episode_time)
+                    startup_reported = True
 
                 # Update the obstacles list and check to see if we need to follow the lead vehicle.
-                obstacles,pedestrians_info,pedestrians,cars,lead_car_state=update_obstacles(bp,measurement_data,current_x,current_y,ego_state)
+                obstacles,pedestrians_info,pedestrians,cars,lead_car_state=update_obstacles(bp,measurement_data,current_x,current_y,ego_state,
+                                                                                        obstacle_buffers)
+                # Index the obstacle points once for all of this tick's collision checks.
+                if PREDICT_PEDESTRIANS:
+                    pedestrians_obstacles = collision_checker.ObstaclePrediction(
+                        pedestrians,
+                        [[p[0].x, p[0].y] for p in pedestrians_info],
+                        [p[1] for p in pedestrians_info],
+                        [p[2] for p in pedestrians_info])
+                else:
+                    pedestrians_obstacles = collision_checker.ObstacleIndex(pedestrians, OBSTACLE_BORDER_SAMPLES)
+                cars_index = collision_checker.ObstacleIndex(cars, OBSTACLE_BORDER_SAMPLES)
 
                 # Compute the goal state set from the behavioural planner's computed goal state.
                 goal_state_set = lp.get_goal_state_set(bp._goal_index, bp._goal_state, waypoints, ego_state)
@@ -1227,17 +1479,24 @@ def exec_waypoint_nav_demo(args):
                 # Transform those paths back to the global frame.
                 paths = local_planner.transform_paths(paths, ego_state)
 
-                # Perform  pedestrian collision checking.
-                pedestrian_collision_check_array=lp._collision_checker.collision_check_pedestrian(paths, pedestrians)
-                bp._obstacle,is_active_collision=predict_pedestrian_collisions(pedestrian_collision_check_array,pedestrians_info,ego_state,DELTA_ORIENTATION)
+                # Perform pedestrian and cars collision checking in a single pass over the paths.
+                # The predicted pedestrians are checked at the time the ego-vehicle reaches each path point,
+                # following the nominal speed profile of each path from the open loop speed.
+                path_speeds = [lp._velocity_planner.nominal_profile(path, open_loop_speed, bp._goal_state[2])[:, 2]
+                               for path in paths]
+                path_times = collision_checker.path_point_times(paths, path_speeds)
+                pedestrian_collision_check_array, collision_check_array = \
+                    lp._collision_checker.collision_check_classes(paths, {'pedestrian': pedestrians_obstacles,
+                                                                          'car': cars_index},
+                                                                  path_times)
+                bp._obstacle,is_active_collision=predict_pedestrian_collisions(pedestrian_collision_check_array,pedestrians_info,ego_state,DELTA_ORIENTATION,
+                                                                               PREDICT_PEDESTRIANS)
 
                 # check if the ego_vehicle is in an intersection
                 in_intersection=manage_intersection(intersection_rectangles, ego_state,measurement_data)
                 if in_intersection:
                     bp.set_lookahead(30)
 
-                #Perform  cars collision checking.
-                collision_check_array = lp._collision_checker.collision_check(paths, cars)
                 cars_collision = np.array(collision_check_array)
 
                 # Compute the best local path.
@@ -1265,19 +1524,19 @@ def exec_waypoint_nav_demo(args):
                     local_waypoints = lp._velocity_planner.compute_velocity_profile(best_path, desired_speed, ego_state, current_speed, decelerate_to_tl, lead_car_state,follow_lead_vehicle,emergency_break)
 
 
-                    if local_waypoints != None:
+                    if local_waypoints is not None:
                         # Update the controller waypoint path with the best local path.
                         # This controller is similar to that developed in Course 1 of this
                         # specialization.  Linear interpolation computation on the waypoints
                         # is also used to ensure a fine resolution between points.
-                        wp_distance = []   # distance array
+                        # The waypoints are the points of best_path, so the distances between
+                        # them are its cached segment lengths, except for the first one: the
+                        # velocity planner moves the zeroth waypoint towards the first one.
                         local_waypoints_np = np.array(local_waypoints)
-                        for i in range(1, local_waypoints_np.shape[0]):
-                            wp_distance.append(
-                                    np.sqrt((local_waypoints_np[i, 0] - local_waypoints_np[i-1, 0])**2 +
-                                            (local_waypoints_np[i, 1] - local_waypoints_np[i-1, 1])**2))
-                        wp_distance.append(0)  # last distance is 0 because it is the distance
-                                            # from the last waypoint to the last waypoint
+                        wp_distance = np.append(best_path.segment_length, 0)  # last distance is 0 because it is the distance
+                                                                              # from the last waypoint to the last waypoint
+                        if len(local_waypoints_np) > 1:
+                            wp_distance[0] = np.linalg.norm(local_waypoints_np[1, :2] - local_waypoints_np[0, :2])
 
                         # Linearly interpolate between waypoints and store in a list
                         wp_interp      = []    # interpolated values
@@ -1313,7 +1572,7 @@ def exec_waypoint_nav_demo(args):
             ###
             # Controller Update
             ###
-            if local_waypoints != None and local_waypoints != []:
+            if local_waypoints is not None and len(local_waypoints) > 0:
                 controller.update_values(current_x, current_y, current_yaw,
                                          current_speed,
                                          current_timestamp, frame)
@@ -1333,7 +1592,7 @@ def exec_waypoint_nav_demo(args):
             # Skip the first frame or if there exists no local paths
             if skip_first_frame and frame == 0:
                 pass
-            elif local_waypoints == None:
+            elif local_waypoints is None:
                 pass
             else:
                 # Update live plotter with new feedback
@@ -1440,6 +1699,8 @@ def exec_waypoint_nav_demo(args):
             print("Exceeded assessment time. Writing to controller_output...")
         # Stop the car
         send_control_command(client, throttle=0.0, steer=0.0, brake=1.0)
+        if ASYNC_TL_DETECTION:
+            tl_detector.stop()
         # Store the various outputs
         store_trajectory_plot(trajectory_fig.fig, 'trajectory.png')
         store_trajectory_plot(forward_speed_fig.fig, 'forward_speed.png')
@@ -1450,6 +1711,32 @@ def exec_waypoint_nav_demo(args):
                               collided_flag_history)
         write_collisioncount_file(collided_flag_history)
 
+        # Report how much warm starting saved in the spiral optimization, and
+        # how much work the collision broad phase avoided.
+        spiral_stats = lp._path_optimizer.get_iteration_stats()
+        print(f"SPIRAL OPTIMIZER -> cycles : {spiral_stats['cycles']} | "
+              f"warm started : {spiral_stats['warm_spirals']} spirals, "
+              f"{spiral_stats['warm_mean_iterations']:.2f} iterations/spiral | "
+              f"cold started : {spiral_stats['cold_spirals']} spirals, "
+              f"{spiral_stats['cold_mean_iterations']:.2f} iterations/spiral | "
+              f"from table : {spiral_stats['table_spirals']} spirals, "
+              f"{spiral_stats['table_mean_iterations']:.2f} iterations/spiral")
+        pruning_stats = lp._collision_checker.get_pruning_stats()
+        print(f"COLLISION BROAD PHASE -> checks : {pruning_stats['checks']} | "
+              f"pruned pairs : {100 * pruning_stats['pair_pruning_ratio']:.1f}% | "
+              f"pruned paths : {100 * pruning_stats['path_pruning_ratio']:.1f}%")
+        if SCHEDULE_TL_DETECTION:
+            schedule_stats = tl_scheduler.get_stats()
+            print(f"DETECTION SCHEDULER -> planner ticks : {schedule_stats['ticks']} | "
+                  f"detections : {schedule_stats['runs']} | "
+                  f"duty cycle : {100 * schedule_stats['duty_cycle']:.1f}%")
+        if ASYNC_TL_DETECTION:
+            detection_stats = tl_detector.get_stats()
+            print(f"TRAFFIC LIGHT DETECTOR -> frames : {detection_stats['submitted']} | "
+                  f"processed : {detection_stats['processed']} | "
+                  f"dropped : {detection_stats['dropped']} | "
+                  f"mean latency : {1000 * detection_stats['mean_latency']:.1f} ms")
+
 def main():
     """Main function.
 
@@ -4,11 +4,71 @@ import scipy.optimize
 import scipy.integrate
 from math import sin, cos, pi, sqrt
 
+# cumtrapz was renamed cumulative_trapezoid in scipy 1.6 and removed in 1.14.
+try:
+    from scipy.integrate import cumulative_trapezoid
+except ImportError:
+    from scipy.integrate import cumtrapz as cumulative_trapezoid
+
+# Simpson's rule over 8 intervals of the normalized arc length u = s/sf, which
+# is the quadrature the fxf/fyf expressions below were expanded from. The node
+# u = 0 is left out since its sample is always cos(0) = 1, sin(0) = 0.
+SIMPSON_NODES   = np.arange(1, 9) / 8.0
+SIMPSON_WEIGHTS = np.array([4.0, 2.0, 4.0, 2.0, 4.0, 2.0, 4.0, 1.0])
+
+# With p0 = p3 = 0, theta(u) = sf * (p1 * A(u) + p2 * B(u)) where A and B are
+# the contributions of p1 and p2 to the integrated cubic curvature.
+SIMPSON_A = 4.5*SIMPSON_NODES**2 - 7.5*SIMPSON_NODES**3 + 3.375*SIMPSON_NODES**4
+SIMPSON_B = -2.25*SIMPSON_NODES**2 + 6.0*SIMPSON_NODES**3 - 3.375*SIMPSON_NODES**4
+
+# Stopping criteria of the batched spiral optimizer. The tolerances match the
+# defaults of scipy's L-BFGS-B (pgtol and factr * machine epsilon).
+BATCH_MAX_ITER        = 100
+BATCH_GTOL            = 1e-5
+BATCH_FTOL            = 2.2e-9
+BATCH_INITIAL_DAMPING = 1e-3
+BATCH_MAX_DAMPING     = 1e10
+
+# Largest change in goal distance (m) and yaw (rad) of a lateral offset slot
+# between two planning cycles for which its previous spiral is reused as the
+# initial guess of the optimizer.
+WARM_START_MAX_GOAL_JUMP = 2.0
+WARM_START_MAX_YAW_JUMP  = 0.2
+
+# Objective backends of optimize_spiral. 'simpson' evaluates the Simpson
+# quadrature as arrays (see spiral_endpoints), 'legacy' uses the original
+# symbolic expansions of fxf, fyf and their gradients, and is kept for
+# regression comparisons.
+OBJECTIVE_BACKENDS = ('simpson', 'legacy')
+
+# Number of optimizer iterations used to refine the parameters interpolated
+# from the spiral table (see spiral_table.py). Refined spirals which still miss
+# their goal by more than VALID_GOAL_ERROR (m, rad), the tolerance of the path
+# validity check of the local planner, are solved again from scratch.
+TABLE_REFINE_ITER = 1
+VALID_GOAL_ERROR  = 0.1
+
 class PathOptimizer:
-    def __init__(self):
+    def __init__(self, spiral_table=None, table_refine=True,
+                 objective_backend='simpson'):
+        if objective_backend not in OBJECTIVE_BACKENDS:
+            raise ValueError('Unknown objective backend: %s' % objective_backend)
+        self._objective_backend = objective_backend
+        self._spiral_table = spiral_table
+        self._table_refine_iter = TABLE_REFINE_ITER if table_refine else 0
         self._xf = 0.0
         self._yf = 0.0
         self._tf = 0.0
+        self._xfs = np.zeros(0)
+        self._yfs = np.zeros(0)
+        self._tfs = np.zeros(0)
+        self._prev_goals = None
+        self._prev_params = None
+        self._iteration_stats = {'cycles': 0,
+                                 'warm_spirals': 0, 'warm_iterations': 0,
+                                 'cold_spirals': 0, 'cold_iterations': 0,
+                                 'table_spirals': 0, 'table_iterations': 0,
+                                 'table_fallbacks': 0}
 
     # Sets up the optimization problem to compute a spiral to a given
     # goal point, (xf, yf, tf).
@@ -61,16 +121,195 @@ class PathOptimizer:
 
 
         # Here we will call scipy.optimize.minimize to optimize our spiral.
-        # The objective and gradient are given to you by self.objective, and
-        # self.objective_grad. The bounds are computed above, and the inital
+        # The objective and gradient are computed together by
+        # self.objective_and_grad. The bounds are computed above, and the inital
         # variables for the optimizer are set by p0. You should use the L-BFGS-B
         # optimization methods.
 
-        res = scipy.optimize.minimize(self.objective,p0,method='L-BFGS-B',bounds=bounds,jac=self.objective_grad)
+        res = scipy.optimize.minimize(self.objective_and_grad,p0,method='L-BFGS-B',bounds=bounds,jac=True)
 
         spiral = self.sample_spiral(res.x)
         return spiral
 
+    # Sets up a single optimization problem that computes the spirals to all
+    # of the given goal points at once.
+    def optimize_spirals(self, goal_states, warm_start=True):
+        """Batched version of optimize_spiral over a whole goal state set.
+
+        The objective of each spiral is the same as in optimize_spiral, but
+        the objective, gradient and Hessian of all the spirals are evaluated
+        together with numpy, and all of them are converged in a single
+        projected Newton loop (see minimize_batch).
+
+        args:
+            goal_states: Set of goal states in the vehicle frame.
+                format: [[x0, y0, t0, ...],
+                         [x1, y1, t1, ...],
+                         ...
+                         [xm, ym, tm, ...]]
+                , only the first three columns (position and yaw) are used.
+            warm_start: If true, each spiral starts from the solution found
+                for the same lateral offset slot on the previous call instead
+                of a straight line, unless its goal has jumped since then.
+                Goals covered by the spiral table, if one was given, take the
+                interpolated table parameters instead and are only refined for
+                TABLE_REFINE_ITER iterations.
+
+        returns:
+            spirals: List of the resulting optimized paths, one per goal state,
+                each in the format returned by optimize_spiral.
+        """
+        goal_states = np.asarray(goal_states, dtype=float)
+        if len(goal_states) == 0:
+            return []
+
+        # The batch is evaluated with the Simpson engine only, so the legacy
+        # backend optimizes the spirals one by one.
+        if self._objective_backend == 'legacy':
+            return [self.optimize_spiral(*goal_state[:3])
+                    for goal_state in goal_states]
+
+        # Same initial guess as optimize_spiral, for every spiral, with one
+        # row of [p1, p2, sf] per spiral.
+        goals = goal_states[:, :3]
+        p0 = straight_line_params(goals)
+
+        warm = np.zeros(len(goal_states), dtype=bool)
+        if warm_start:
+            p0, warm = self.warm_start_params(goals, p0)
+
+        table = np.zeros(len(goal_states), dtype=bool)
+        if self._spiral_table is not None:
+            table_params, table = self._spiral_table.lookup(goals)
+            p0[table] = table_params[table]
+            warm &= ~table
+
+        max_iter = np.where(table, self._table_refine_iter, BATCH_MAX_ITER)
+        params, iterations = self.solve_spirals(goals, p0, max_iter)
+
+        # The refined table parameters are only close to the solution, so the
+        # spirals which miss their goal are solved again from a straight line.
+        fallback = table & (spiral_goal_error(params, goals) > VALID_GOAL_ERROR)
+        if np.any(fallback):
+            params[fallback], fallback_iterations = self.solve_spirals(goals[fallback])
+            iterations[fallback] += fallback_iterations
+
+        # Remember the solution of every slot for the next planning cycle.
+        self._prev_goals = goal_states[:, :3].copy()
+        self._prev_params = params.copy()
+
+        stats = self._iteration_stats
+        stats['cycles'] += 1
+        cold = ~warm & ~table
+        stats['warm_spirals'] += np.count_nonzero(warm)
+        stats['warm_iterations'] += np.sum(iterations[warm])
+        stats['cold_spirals'] += np.count_nonzero(cold)
+        stats['cold_iterations'] += np.sum(iterations[cold])
+        stats['table_spirals'] += np.count_nonzero(table)
+        stats['table_iterations'] += np.sum(iterations[table])
+        stats['table_fallbacks'] += np.count_nonzero(fallback)
+
+        return self.sample_spirals(params)
+
+    # Solves the spirals to a batch of goal points, with the bounds of
+    # optimize_spiral, and returns their parameters instead of sampling them.
+    def solve_spirals(self, goals, p0=None, max_iter=BATCH_MAX_ITER):
+        """Optimizes the parameters of the spirals to a set of goals.
+
+        args:
+            goals: Array of [xf, yf, tf] goals in the vehicle frame.
+            p0: Array of initial [p1, p2, sf] parameters for each goal, a
+                straight line to the goal (see straight_line_params) if None.
+            max_iter: Maximum number of iterations, for all of the spirals or
+                as an array with one value per spiral.
+        returns:
+            [params, iterations]:
+                params: Array of the optimized [p1, p2, sf] parameters, one
+                    row per goal.
+                iterations: Array of the number of iterations of each spiral.
+        """
+        goals = np.asarray(goals, dtype=float)
+        if p0 is None:
+            p0 = straight_line_params(goals)
+
+        # Save the terminal x, y, and theta of every spiral.
+        self._xfs = goals[:, 0]
+        self._yfs = goals[:, 1]
+        self._tfs = goals[:, 2]
+
+        # Same bounds as optimize_spiral: the curvatures lie within
+        # [-0.5, 0.5], and the arc length is at least the straight line
+        # distance to the goal.
+        sf_0 = np.hypot(self._xfs, self._yfs)
+        lower = np.column_stack((np.full_like(sf_0, -0.5),
+                                 np.full_like(sf_0, -0.5),
+                                 sf_0))
+        upper = np.column_stack((np.full_like(sf_0, 0.5),
+                                 np.full_like(sf_0, 0.5),
+                                 np.full_like(sf_0, np.inf)))
+        return self.minimize_batch(p0, lower, upper, max_iter)
+
+    # Computes the initial guess of each spiral from the solution of the
+    # previous planning cycle.
+    def warm_start_params(self, goals, p0):
+        """Warm starts the spiral parameters from the previous cycle.
+
+        The goal state set is expressed in the ego frame, which moves between
+        planning cycles, so the previous spiral of a slot is re-expressed in
+        the new ego frame by scaling it onto the new goal distance (a spiral
+        scaled by k keeps its headings, with its curvatures divided by k and
+        its arc length multiplied by k). Slots whose goal jumped further than
+        WARM_START_MAX_GOAL_JUMP or WARM_START_MAX_YAW_JUMP since the previous
+        cycle, e.g. when the goal index advances, keep their cold start.
+
+        args:
+            goals: Array of [xf, yf, tf] goals in the current ego frame.
+            p0: Array of cold start [p1, p2, sf] parameters for each goal.
+        returns:
+            [p0, warm]:
+                p0: Array of initial [p1, p2, sf] parameters for each goal.
+                warm: Boolean array, true where the slot was warm started.
+        """
+        warm = np.zeros(len(goals), dtype=bool)
+        if self._prev_goals is None or len(self._prev_goals) != len(goals):
+            return p0, warm
+
+        prev_dist = np.hypot(self._prev_goals[:, 0], self._prev_goals[:, 1])
+        dist = np.hypot(goals[:, 0], goals[:, 1])
+        yaw_jump = np.abs(np.arctan2(np.sin(goals[:, 2] - self._prev_goals[:, 2]),
+                                     np.cos(goals[:, 2] - self._prev_goals[:, 2])))
+        warm = (np.abs(dist - prev_dist) <= WARM_START_MAX_GOAL_JUMP) & \
+               (yaw_jump <= WARM_START_MAX_YAW_JUMP) & (prev_dist > 0.0)
+
+        scale = dist[warm] / prev_dist[warm]
+        p0 = p0.copy()
+        p0[warm, 0] = self._prev_params[warm, 0] / scale
+        p0[warm, 1] = self._prev_params[warm, 1] / scale
+        p0[warm, 2] = np.maximum(self._prev_params[warm, 2] * scale, dist[warm])
+
+        return p0, warm
+
+    def get_last_params(self):
+        """Returns the array of [p1, p2, sf] parameters of the spirals
+        optimized by the last call to optimize_spirals, or None."""
+        return self._prev_params
+
+    def get_iteration_stats(self):
+        """Returns the iteration counts of optimize_spirals so far.
+
+        returns:
+            stats: Dictionary with the number of planning cycles, and the
+                number of warm/cold/table started spirals along with their
+                mean number of optimizer iterations, and the number of table
+                started spirals solved again from scratch.
+        """
+        stats = dict(self._iteration_stats)
+        for start in ['warm', 'cold', 'table']:
+            spirals = stats[start + '_spirals']
+            stats[start + '_mean_iterations'] = \
+                stats[start + '_iterations'] / spirals if spirals > 0 else 0.0
+        return stats
+
     # This function computes the theta values for a given list of
     # arc lengths, and spiral parameters a, b, c, d.
     # Recall that the equation of a cubic spiral is
@@ -135,10 +374,41 @@ class PathOptimizer:
         # Try to vectorize the code using numpy functions for speed if you can.
 
         t_points = self.thetaf(a, b, c, d, s_points)
-        x_points = scipy.integrate.cumtrapz(np.cos(t_points),s_points)
-        y_points = scipy.integrate.cumtrapz(np.sin(t_points),s_points)
+        x_points = cumulative_trapezoid(np.cos(t_points),s_points)
+        y_points = cumulative_trapezoid(np.sin(t_points),s_points)
         return [x_points.tolist(), y_points.tolist(), t_points.tolist()]
 
+    # Batched version of sample_spiral, sampling every spiral along its own
+    # arc length in a single set of array operations.
+    def sample_spirals(self, params):
+        """Samples a set of points along each spiral given its optimization
+        parameters.
+
+        args:
+            params: Array of optimization parameters, one row per spiral.
+                Format: [[p1, p2, sf], ...], Unit: [1/m, 1/m, m]
+        returns:
+            spirals: List of [x_points, y_points, t_points], one per spiral,
+                in the same format as sample_spiral.
+        """
+        params = np.asarray(params, dtype=float)
+        p1 = params[:, 0:1]
+        p2 = params[:, 1:2]
+        sf = params[:, 2:3]
+
+        # Same spiral parameter mapping as sample_spiral, with p0 = p3 = 0.
+        b = (9.0*p1 - 9.0*p2/2.0)/sf
+        c = (-45.0*p1/2.0 + 18.0*p2)/sf**2
+        d = (27.0*p1/2.0 - 27.0*p2/2.0)/sf**3
+
+        s_points = sf * np.linspace(0.0, 1.0)
+        t_points = self.thetaf(0.0, b, c, d, s_points)
+        x_points = cumulative_trapezoid(np.cos(t_points), s_points, axis=1)
+        y_points = cumulative_trapezoid(np.sin(t_points), s_points, axis=1)
+
+        return [[x.tolist(), y.tolist(), t.tolist()]
+                for x, y, t in zip(x_points, y_points, t_points)]
+
     ######################################################
     ######################################################
     # BELOW ARE THE FUNCTIONS USED FOR THE OPTIMIZER.
@@ -150,18 +420,157 @@ class PathOptimizer:
         The optimizer can freely move 3 of the spiral parameter variables.
         The other two are fixed due to boundary conditions.
         """
-        p = [0.0, p[0], p[1], 0.0, p[2]]
-        return self.fbe(p) + 25*(self.fxf(p) + self.fyf(p)) + 30*self.ftf(p)
+        return self.objective_and_grad(p)[0]
 
     def objective_grad(self, p):
         """
         The optimizer can freely move 3 of the spiral parameter variables.
         The other two are fixed due to boundary conditions.
         """
+        return self.objective_and_grad(p)[1]
+
+    def objective_and_grad(self, p):
+        """
+        Objective of optimize_spiral and its gradient, computed together by
+        the objective backend selected in the constructor.
+        """
+        if self._objective_backend == 'legacy':
+            return self.objective_legacy(p), self.objective_grad_legacy(p)
+        return self.objective_simpson(p)
+
+    def objective_simpson(self, p):
+        """
+        Simpson backend of objective_and_grad, evaluating the endpoint of the
+        spiral and its gradient with spiral_endpoints. Gives the same values
+        as the legacy backend up to rounding.
+        """
+        p1, p2, sf = p[0], p[1], p[2]
+        x, y, t, x_grad, y_grad, t_grad = spiral_endpoints([p1], [p2], [sf])
+        x_err = self._xf - x[0]
+        y_err = self._yf - y[0]
+        t_err = self._tf - t[0]
+
+        be = p1*p1*324.0 + p2*p2*324.0 - p1*p2*81.0
+        f = sf*be*(1.0/840.0) + 25*(x_err*x_err + y_err*y_err) + 30*t_err*t_err
+
+        fbe_grad = np.array([sf*(p1*648.0 - p2*81.0)*(1.0/840.0),
+                             sf*(p2*648.0 - p1*81.0)*(1.0/840.0),
+                             be*(1.0/840.0)])
+        grad = fbe_grad - 50*x_err*x_grad[0] - 50*y_err*y_grad[0] \
+                        - 60*t_err*t_grad[0]
+        return f, grad
+
+    def objective_legacy(self, p):
+        """
+        Legacy backend of objective, built from the symbolic expansions below.
+        """
+        p = [0.0, p[0], p[1], 0.0, p[2]]
+        return self.fbe(p) + 25*(self.fxf(p) + self.fyf(p)) + 30*self.ftf(p)
+
+    def objective_grad_legacy(self, p):
+        """
+        Legacy backend of objective_grad, built from the symbolic expansions
+        below.
+        """
         p = [0.0, p[0], p[1], 0.0, p[2]]
         return np.add(np.add(np.add(self.fbe_grad(p), np.multiply(25, self.fxf_grad(p))), \
             np.multiply(25, self.fyf_grad(p))), np.multiply(30, self.ftf_grad(p)))
 
+    def objective_batch(self, p):
+        """
+        Objective of each spiral in the batch set up by optimize_spirals,
+        where p holds one row of [p1, p2, sf] per spiral. Returns the
+        objective, its gradient and its Gauss-Newton Hessian for every spiral.
+        """
+        p1, p2, sf = p[:, 0], p[:, 1], p[:, 2]
+
+        x, y, t, x_grad, y_grad, t_grad = spiral_endpoints(p1, p2, sf)
+        x_err = self._xfs - x
+        y_err = self._yfs - y
+        t_err = self._tfs - t
+
+        # Bending energy of the spiral, and its gradient.
+        be = p1*p1*324.0 + p2*p2*324.0 - p1*p2*81.0
+        be_p1 = (p1*648.0 - p2*81.0)*(1.0/840.0)
+        be_p2 = (p2*648.0 - p1*81.0)*(1.0/840.0)
+        fbe_grad = np.column_stack((sf*be_p1, sf*be_p2, be*(1.0/840.0)))
+
+        f = sf*be*(1.0/840.0) + 25*(x_err*x_err + y_err*y_err) + 30*t_err*t_err
+        grad = fbe_grad - 50*x_err[:, None]*x_grad \
+                        - 50*y_err[:, None]*y_grad \
+                        - 60*t_err[:, None]*t_grad
+
+        # The endpoint penalties are least squares terms, so their Hessian is
+        # approximated by the outer products of the endpoint gradients. The
+        # bending energy Hessian is exact.
+        hess = 50*x_grad[:, :, None]*x_grad[:, None, :] \
+             + 50*y_grad[:, :, None]*y_grad[:, None, :] \
+             + 60*t_grad[:, :, None]*t_grad[:, None, :]
+        hess[:, 0, 0] += sf*(648.0/840.0)
+        hess[:, 1, 1] += sf*(648.0/840.0)
+        hess[:, 0, 1] -= sf*(81.0/840.0)
+        hess[:, 1, 0] -= sf*(81.0/840.0)
+        hess[:, 0, 2] += be_p1
+        hess[:, 2, 0] += be_p1
+        hess[:, 1, 2] += be_p2
+        hess[:, 2, 1] += be_p2
+
+        return f, grad, hess
+
+    def minimize_batch(self, p, lower, upper, max_iter=BATCH_MAX_ITER):
+        """
+        Minimizes objective_batch for every spiral at once with a projected
+        Levenberg-Marquardt iteration. Each spiral keeps its own damping and
+        stops on its own, using the same tolerances as scipy's L-BFGS-B, but
+        every iteration is a single vectorized evaluation of the whole batch.
+        max_iter is either a single iteration limit or one limit per spiral.
+        Returns the optimized parameters and the number of iterations each
+        spiral took to converge.
+        """
+        max_iter = np.broadcast_to(max_iter, (len(p),))
+        p = np.clip(p, lower, upper)
+        f, grad, hess = self.objective_batch(p)
+        damping = np.full(len(p), BATCH_INITIAL_DAMPING)
+        active = np.ones(len(p), dtype=bool)
+        eye = np.eye(3)
+
+        iterations = np.zeros(len(p), dtype=int)
+        for _ in range(np.max(max_iter, initial=0)):
+            # Variables held at a bound by the gradient are fixed for this
+            # step, and the spirals with a small projected gradient are done.
+            fixed = ((p <= lower) & (grad > 0)) | ((p >= upper) & (grad < 0))
+            proj_grad = np.where(fixed, 0.0, grad)
+            active &= np.max(np.abs(proj_grad), axis=1) > BATCH_GTOL
+            active &= iterations < max_iter
+            if not np.any(active):
+                break
+            iterations += active
+
+            # Damped Newton step over the free variables of each spiral.
+            free = ~fixed
+            system = np.where(free[:, :, None] & free[:, None, :], hess, 0.0) \
+                   + eye*fixed[:, :, None]
+            diag = np.maximum(np.abs(np.diagonal(hess, axis1=1, axis2=2)), 1e-6)
+            system += damping[:, None, None]*eye*diag[:, :, None]
+            step = np.linalg.solve(system, -proj_grad[:, :, None])[:, :, 0]
+
+            p_new = np.clip(p + step, lower, upper)
+            f_new, grad_new, hess_new = self.objective_batch(p_new)
+
+            # Keep the steps that decreased the objective and relax their
+            # damping, otherwise retry with a more conservative step.
+            accepted = active & (f_new < f)
+            converged = accepted & (f - f_new <= BATCH_FTOL*np.maximum(
+                np.maximum(np.abs(f), np.abs(f_new)), 1.0))
+            p[accepted] = p_new[accepted]
+            f[accepted] = f_new[accepted]
+            grad[accepted] = grad_new[accepted]
+            hess[accepted] = hess_new[accepted]
+            damping = np.where(accepted, damping*0.3, damping*10.0)
+            active &= ~converged & (damping < BATCH_MAX_DAMPING)
+
+        return p, iterations
+
     def fxf(self, p):
         t2 = p[0]*(1.1E1/2.0);
         t3 = p[1]*9.0;
@@ -493,3 +902,68 @@ class PathOptimizer:
         grad[2] = t0
 
         return grad
+
+# Initial guess of optimize_spiral: a straight line to each goal.
+def straight_line_params(goals):
+    """Returns the [0, 0, sf_0] parameters of a straight line to each of the
+    [xf, yf, tf] goals, sf_0 being the straight line distance to the goal."""
+    goals = np.asarray(goals, dtype=float)
+    sf_0 = np.hypot(goals[:, 0], goals[:, 1])
+    return np.column_stack((np.zeros_like(sf_0), np.zeros_like(sf_0), sf_0))
+
+# Distance between the end of each spiral and its goal.
+def spiral_goal_error(params, goals):
+    """Returns the distance between the end of each spiral and its goal.
+
+    args:
+        params: Array of [p1, p2, sf] parameters, one row per spiral.
+        goals: Array of [xf, yf, tf] goals, one row per spiral.
+    returns:
+        error: Array of the norm of the [x, y, yaw] endpoint errors.
+    """
+    x, y, t = spiral_endpoints(params[:, 0], params[:, 1], params[:, 2])[:3]
+    return np.linalg.norm([x - goals[:, 0], y - goals[:, 1],
+                           t - goals[:, 2]], axis=0)
+
+# Computes the endpoint of a batch of spirals, using Simpson's rule on the
+# shared cos/sin samples of the heading, along with the gradient of each
+# endpoint coordinate with respect to the optimization parameters.
+def spiral_endpoints(p1, p2, sf):
+    """Computes the endpoints of a set of spirals and their gradients.
+
+    args:
+        p1: Array of curvatures 1/3rd of the way along each spiral (1/m).
+        p2: Array of curvatures 2/3rds of the way along each spiral (1/m).
+        sf: Array of final arc lengths of each spiral (m).
+    returns:
+        [x, y, t, x_grad, y_grad, t_grad]:
+            x, y, t: Arrays of the final x (m), y (m) and yaw (rad) of each
+                spiral, in the frame of its starting point.
+            x_grad, y_grad, t_grad: Arrays of shape (n, 3) with the gradient
+                of x, y and t with respect to [p1, p2, sf] for each spiral.
+    """
+    p1 = np.asarray(p1, dtype=float)[:, None]
+    p2 = np.asarray(p2, dtype=float)[:, None]
+    sf = np.asarray(sf, dtype=float)[:, None]
+
+    # Heading at every Simpson node, and its derivative with respect to
+    # p1 and p2 (the derivative with respect to sf is theta / sf).
+    thetas = sf*(p1*SIMPSON_A + p2*SIMPSON_B)
+    cos_w = SIMPSON_WEIGHTS*np.cos(thetas)
+    sin_w = SIMPSON_WEIGHTS*np.sin(thetas)
+
+    sf = sf[:, 0]
+    h = sf*(1.0/24.0)
+    x = h*(1.0 + np.sum(cos_w, axis=1))
+    y = h*np.sum(sin_w, axis=1)
+    t = 0.375*sf*(p1[:, 0] + p2[:, 0])
+
+    x_grad = np.column_stack((-h*sf*np.dot(sin_w, SIMPSON_A),
+                              -h*sf*np.dot(sin_w, SIMPSON_B),
+                              (1.0 + np.sum(cos_w - sin_w*thetas, axis=1))*(1.0/24.0)))
+    y_grad = np.column_stack((h*sf*np.dot(cos_w, SIMPSON_A),
+                              h*sf*np.dot(cos_w, SIMPSON_B),
+                              np.sum(sin_w + cos_w*thetas, axis=1)*(1.0/24.0)))
+    t_grad = np.column_stack((0.375*sf, 0.375*sf, t/sf))
+
+    return x, y, t, x_grad, y_grad, t_grad
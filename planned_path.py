@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+import numpy as np
+
+# Planned path of the local planner, with the geometry shared by the collision
+# checker, the velocity planner and the waypoint interpolation computed once
+# when the path is built.
+class PlannedPath:
+    """Path in the global frame along with its arc length and curvature.
+
+    A PlannedPath still indexes as a [x_points, y_points, t_points] path, so
+    that path[0], path[1] and path[2] are the x, y and yaw arrays.
+
+    attributes:
+        x, y: position (m) of each point.
+        yaw: top-down orientation (rad) at each point.
+        segment_length: distance (m) from each point to the next one, one
+            value less than there are points.
+        s: arc length (m) from the start of the path to each point.
+        curvature: signed curvature (1/m) at each point, the rate of change of
+            the yaw along the path.
+    """
+    __slots__ = ('x', 'y', 'yaw', 'segment_length', 's', 'curvature')
+
+    def __init__(self, x, y, yaw):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.yaw = np.asarray(yaw, dtype=float)[:len(self.x)]
+        self.segment_length = np.hypot(np.diff(self.x), np.diff(self.y))
+        self.s = np.concatenate(([0.0], np.cumsum(self.segment_length)))
+        self.curvature = path_curvature(self.yaw, self.segment_length)
+
+    def __getitem__(self, index):
+        return (self.x, self.y, self.yaw)[index]
+
+    def __len__(self):
+        return 3
+
+    def __iter__(self):
+        return iter((self.x, self.y, self.yaw))
+
+    @property
+    def length(self):
+        return self.s[-1]
+
+    @property
+    def num_points(self):
+        return len(self.x)
+
+# Curvature of each point as the yaw change over the neighbouring segments.
+def path_curvature(yaw, segment_length):
+    """Computes the curvature along a path by finite differences of the yaw.
+
+    args:
+        yaw: yaw values (rad) at each point of the path.
+        segment_length: distances (m) between consecutive points.
+    returns:
+        curvature: curvature (1/m) at each point, the mean of the curvatures of
+            the segments on either side of it. Zero length segments have zero
+            curvature.
+    """
+    curvature = np.zeros(len(yaw))
+    if len(yaw) < 2:
+        return curvature
+    dyaw = np.diff(np.unwrap(yaw))
+    segment_curvature = np.divide(dyaw, segment_length,
+                                  out=np.zeros_like(dyaw),
+                                  where=segment_length > 1e-6)
+    curvature[:-1] += segment_curvature
+    curvature[1:] += segment_curvature
+    curvature[1:-1] /= 2
+    return curvature
@@ -16,59 +16,100 @@ def bbox_iou(box1, box2):
     return float(intersect) / union
 
 
-def decode_netout(netout, anchors, nb_class, obj_threshold=0.3, nms_threshold=0.3):
-    grid_h, grid_w, nb_box = netout.shape[:3]
-    #grid_h, grid_w, nb_box = config['models']['traffic_light_module']['grid_h'], GRID_W, BOX
-    boxes = []
-
-    # decode the output by the network
-    netout[..., 4] = _sigmoid(netout[..., 4])
-    netout[..., 5:] = netout[..., 4][..., np.newaxis] * _softmax(netout[..., 5:])
-    netout[..., 5:] *= netout[..., 5:] > obj_threshold
-
-    for row in range(grid_h):
-        for col in range(grid_w):
-            for b in range(nb_box):
-                # from 4th element onwards are confidence and class classes
-                classes = netout[row, col, b, 5:]
-
-                if np.sum(classes) > 0:
-                    # first 4 elements are x, y, w, and h
-                    x, y, w, h = netout[row, col, b, :4]
-
-                    x = (col + _sigmoid(x)) / grid_w  # center position, unit: image width
-                    y = (row + _sigmoid(y)) / grid_h  # center position, unit: image height
-
-                    w = anchors[2 * b + 0] * np.exp(w) / grid_w  # unit: image width
-                    h = anchors[2 * b + 1] * np.exp(h) / grid_h  # unit: image height
-                    confidence = netout[row, col, b, 4]
-
-                    box = BoundBox(x - w / 2, y - h / 2, x + w / 2, y + h / 2, confidence, classes)
-
-                    boxes.append(box)
-
-    # suppress non-maximal boxes
-    for c in range(nb_class):
-        sorted_indices = list(reversed(np.argsort([box.classes[c] for box in boxes])))
-
-        for i in range(len(sorted_indices)):
-            index_i = sorted_indices[i]
-
-            if boxes[index_i].classes[c] == 0:
-                continue
-            else:
-                for j in range(i + 1, len(sorted_indices)):
-                    index_j = sorted_indices[j]
+def decode_netout(netout, anchors, nb_class, obj_threshold=0.3, nms_threshold=0.3, max_boxes=1):
+    """Decodes the network output into the detected boxes, most likely first.
+
+    With max_boxes=1 (the default, only the most likely box is ever used) the
+    box is taken with an argmax over the class scores: the box with the highest
+    score is never suppressed by the non-maximum suppression, so it is skipped.
+    Otherwise, all of the boxes that survive the non-maximum suppression are
+    decoded by decode_netout_array, up to max_boxes (None for all of them).
+    """
+    if max_boxes == 1:
+        classes = _class_scores(netout, obj_threshold)
+        index = np.unravel_index(np.argmax(classes), classes.shape)
+        if classes[index] <= obj_threshold:
+            return []
+        row, col, b = index[:3]
+        box = _decode_coordinates(netout[row, col, b, :4], row, col, b, anchors, netout.shape[:3])
+        return [BoundBox(*box, _sigmoid(netout[row, col, b, 4]), classes[row, col, b])]
+
+    boxes = decode_netout_array(netout, anchors, nb_class, obj_threshold, nms_threshold)[:max_boxes]
+    return [BoundBox(box['xmin'], box['ymin'], box['xmax'], box['ymax'], box['confidence'], box['classes'])
+            for box in boxes]
+
+
+def decode_netout_array(netout, anchors, nb_class, obj_threshold=0.3, nms_threshold=0.3):
+    """Decodes the network output into a structured array of the boxes that
+    survive the per class non-maximum suppression, sorted by score.
+
+    Fields: xmin, ymin, xmax, ymax (unit: image width/height), confidence,
+    classes (class scores after the suppression), label and score.
+    """
+    classes = _class_scores(netout, obj_threshold)
+
+    # candidate boxes: any class score above the threshold
+    rows, cols, b = np.nonzero(np.sum(classes, axis=-1) > 0)
+    coords = _decode_coordinates(netout[rows, cols, b, :4].T, rows, cols, b, anchors, netout.shape[:3])
+    coords = np.column_stack(coords)
+    classes = non_max_suppression(coords, classes[rows, cols, b], nms_threshold)
+
+    labels = np.argmax(classes, axis=1)
+    scores = classes[np.arange(len(classes)), labels]
+    keep = np.nonzero(scores > obj_threshold)[0]
+    keep = keep[np.argsort(-scores[keep], kind='stable')]
+
+    boxes = np.zeros(len(keep), dtype=[('xmin', float), ('ymin', float), ('xmax', float), ('ymax', float),
+                                       ('confidence', float), ('classes', float, (nb_class,)),
+                                       ('label', int), ('score', float)])
+    boxes['xmin'], boxes['ymin'], boxes['xmax'], boxes['ymax'] = coords[keep].T
+    boxes['confidence'] = _sigmoid(netout[rows[keep], cols[keep], b[keep], 4])
+    boxes['classes'] = classes[keep]
+    boxes['label'] = labels[keep]
+    boxes['score'] = scores[keep]
+    return boxes
 
-                    if bbox_iou(boxes[index_i], boxes[index_j]) >= nms_threshold:
-                        boxes[index_j].classes[c] = 0
 
-    # remove the boxes which are less likely than a obj_threshold
-    boxes = [box for box in boxes if box.get_score() > obj_threshold]
+def non_max_suppression(coords, classes, nms_threshold):
+    """Greedy per class non-maximum suppression.
 
-    boxes = sorted(boxes, key=lambda box: box.get_score(), reverse=True)
-    if len(boxes) > 0: boxes = [boxes[0]]
-    return boxes
+    args:
+        coords: (N, 4) array of the [xmin, ymin, xmax, ymax] of the boxes.
+        classes: (N, C) array of the class scores of the boxes.
+        nms_threshold: IoU from which the less likely box is suppressed.
+    returns:
+        classes: Copy of the class scores, zeroed for the suppressed boxes.
+    """
+    classes = classes.copy()
+    overlaps = compute_overlap(coords, coords) >= nms_threshold
+    for c in range(classes.shape[1]):
+        order = np.argsort(classes[:, c])[::-1]
+        suppressed = np.zeros(len(order), dtype=bool)
+        for i in np.nonzero(classes[order, c] > 0)[0]:
+            if not suppressed[i]:
+                suppressed[i + 1:] |= overlaps[order[i], order[i + 1:]]
+        classes[order[suppressed], c] = 0
+    return classes
+
+
+def _class_scores(netout, obj_threshold):
+    # class scores = objectness * class probabilities, zeroed below the threshold
+    confidence = _sigmoid(netout[..., 4])
+    classes = confidence[..., np.newaxis] * _softmax(netout[..., 5:])
+    classes *= classes > obj_threshold
+    return classes
+
+
+def _decode_coordinates(xywh, row, col, b, anchors, grid_shape):
+    # center, width and height of the boxes in units of the image width/height
+    grid_h, grid_w = grid_shape[:2]
+    anchors = np.asarray(anchors)
+    x, y, w, h = xywh
+    x = (col + _sigmoid(x)) / grid_w
+    y = (row + _sigmoid(y)) / grid_h
+    w = anchors[2 * b + 0] * np.exp(w) / grid_w
+    h = anchors[2 * b + 1] * np.exp(h) / grid_h
+    return x - w / 2, y - h / 2, x + w / 2, y + h / 2
 
 
 def draw_boxes(image, boxes, labels):
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Precomputed table of optimized spiral parameters.
+
+The optimized spiral only depends on the local goal (xf, yf, tf), which always
+lies in a bounded region in front of the ego vehicle. The table stores the
+optimized [p1, p2, sf] over a regular grid of such goals, so that the path
+optimizer can interpolate an (almost) converged solution instead of running
+the full optimization. Goals outside of the grid, or next to grid cells where
+the optimizer did not reach the goal, fall back to the live optimizer.
+
+Build the table and print the accuracy/latency report with:
+    python spiral_table.py [--rebuild]
+"""
+import os
+import sys
+import time
+import itertools
+import numpy as np
+import path_optimizer
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SPIRAL_TABLE_FILE      = os.path.join(BASE_DIR, 'spiral_table.npy')
+SPIRAL_TABLE_GRID_FILE = os.path.join(BASE_DIR, 'spiral_table_grid.npy')
+
+# Grid of local goals covered by the table, as [start, stop, num] for each of
+# xf (m), yf (m) and tf (rad).
+TABLE_GRID = np.array([[1.0,   41.0, 81],
+                       [-16.0, 16.0, 65],
+                       [-1.6,  1.6,  33]])
+
+# Goals optimized together when building the table.
+BUILD_BATCH_SIZE = 4096
+
+# Same endpoint tolerance (m, rad) as the path validity check of the local
+# planner. Cells whose solution misses the goal by more are stored as NaN.
+VALID_GOAL_ERROR = path_optimizer.VALID_GOAL_ERROR
+
+class SpiralTable:
+    def __init__(self, table_file=SPIRAL_TABLE_FILE,
+                 grid_file=SPIRAL_TABLE_GRID_FILE):
+        # The table is memory-mapped, only the cells around the looked up
+        # goals are ever read from disk.
+        self._params = np.load(table_file, mmap_mode='r')
+        grid = np.load(grid_file)
+        self._start = grid[:, 0]
+        self._num   = grid[:, 2].astype(int)
+        self._step  = (grid[:, 1] - grid[:, 0]) / (self._num - 1)
+
+    def lookup(self, goals):
+        """Interpolates the spiral parameters of a set of goals.
+
+        args:
+            goals: Array of [xf, yf, tf] goals in the vehicle frame.
+        returns:
+            [params, valid]:
+                params: Array of trilinearly interpolated [p1, p2, sf]
+                    parameters, one row per goal.
+                valid: Boolean array, true where the goal lies inside the grid
+                    and all of the surrounding cells hold a solution.
+        """
+        goals = np.asarray(goals, dtype=float)
+        u = (goals - self._start) / self._step
+        inside = np.all((u >= 0.0) & (u <= self._num - 1), axis=1)
+
+        # Lower corner of the cell around each goal, and the position of the
+        # goal inside of it.
+        index = np.clip(np.floor(u), 0, self._num - 2).astype(int)
+        frac  = np.clip(u - index, 0.0, 1.0)
+
+        params = np.zeros((len(goals), 3))
+        for corner in itertools.product((0, 1), repeat=3):
+            corner = np.array(corner)
+            weight = np.prod(np.where(corner, frac, 1.0 - frac), axis=1)
+            cell = index + corner
+            params += weight[:, None] * \
+                self._params[cell[:, 0], cell[:, 1], cell[:, 2]]
+
+        valid = inside & np.all(np.isfinite(params), axis=1)
+        return params, valid
+
+def build_spiral_table(table_file=SPIRAL_TABLE_FILE,
+                       grid_file=SPIRAL_TABLE_GRID_FILE, grid=TABLE_GRID):
+    """Optimizes the spiral to every goal of the grid and saves the table.
+
+    args:
+        table_file: Output .npy file of the [nx, ny, nt, 3] parameter table.
+        grid_file: Output .npy file of the [start, stop, num] grid rows.
+        grid: Goal grid, one [start, stop, num] row for each of xf, yf, tf.
+    """
+    grid = np.asarray(grid, dtype=float)
+    axes = [np.linspace(start, stop, int(num)) for start, stop, num in grid]
+    goals = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    optimizer = path_optimizer.PathOptimizer()
+    params = np.full((len(goals), 3), np.nan)
+    for i in range(0, len(goals), BUILD_BATCH_SIZE):
+        batch = goals[i:i + BUILD_BATCH_SIZE]
+        p, _ = optimizer.solve_spirals(batch)
+
+        valid = goal_error(p, batch) <= VALID_GOAL_ERROR
+        params[i:i + len(batch)][valid] = p[valid]
+
+    np.save(table_file, params.reshape(tuple(grid[:, 2].astype(int)) + (3,)))
+    np.save(grid_file, grid)
+
+def goal_error(params, goals):
+    """Returns the distance between the end of each spiral and its goal.
+
+    args:
+        params: Array of [p1, p2, sf] parameters, one row per spiral.
+        goals: Array of [xf, yf, tf] goals, one row per spiral.
+    returns:
+        error: Array of the norm of the [x, y, yaw] endpoint errors.
+    """
+    return path_optimizer.spiral_goal_error(params, goals)
+
+def report(table, num_sets=500, num_paths=7, path_offset=1.5, seed=0):
+    """Prints the accuracy and latency of table mode against the live
+    optimizer, on random goal state sets laid out like the local planner's.
+    """
+    rng = np.random.RandomState(seed)
+    grid = np.column_stack((table._start,
+                            table._start + table._step*(table._num - 1)))
+    offsets = (np.arange(num_paths) - num_paths // 2) * path_offset
+
+    goal_sets = []
+    for _ in range(num_sets):
+        x, y, t = rng.uniform(grid[:, 0] * 0.8, grid[:, 1] * 0.8)
+        x = max(x, 5.0)
+        goal_sets.append(np.column_stack((x - offsets*np.sin(t),
+                                          y + offsets*np.cos(t),
+                                          np.full(num_paths, t))))
+
+    modes = [('live', path_optimizer.PathOptimizer()),
+             ('table', path_optimizer.PathOptimizer(table, table_refine=False)),
+             ('table + refine', path_optimizer.PathOptimizer(table))]
+    results = {}
+    for name, optimizer in modes:
+        params = []
+        start = time.time()
+        for goals in goal_sets:
+            optimizer.optimize_spirals(goals, warm_start=False)
+            params.append(optimizer.get_last_params())
+        elapsed = (time.time() - start) / num_sets
+        results[name] = np.vstack(params)
+        goals = np.vstack(goal_sets)
+        error = goal_error(results[name], goals)
+        stats = optimizer.get_iteration_stats()
+        print('%-15s %7.3f ms/set  valid %6.2f%%  goal error mean %.4f '
+              'max %.4f  table hits %d/%d  fallbacks %d' %
+              (name, 1000*elapsed, 100*np.mean(error <= VALID_GOAL_ERROR),
+               np.mean(error), np.max(error), stats['table_spirals'],
+               len(goals), stats['table_fallbacks']))
+
+    for name in ['table', 'table + refine']:
+        diff = np.abs(results[name] - results['live'])
+        print('%-15s max |param - live| p1 %.2e  p2 %.2e  sf %.2e' %
+              ((name,) + tuple(np.max(diff, axis=0))))
+
+if __name__ == '__main__':
+    if '--rebuild' in sys.argv or not os.path.exists(SPIRAL_TABLE_FILE):
+        start = time.time()
+        build_spiral_table()
+        print('Built %s in %.1f s' % (SPIRAL_TABLE_FILE, time.time() - start))
+    report(SpiralTable())
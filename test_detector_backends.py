@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+pytest.importorskip('cv2')
+pytest.importorskip('tensorflow')
+pytest.importorskip('keras')
+import carla_detector_model_traffic_light as detector
+from tflite_backend import TFLiteModel, PARITY_TOLERANCE, convert_model
+
+NUM_IMAGES = 3
+
+@pytest.mark.skipif(not (os.path.exists(detector.MODEL_FILE) or
+                         os.path.exists(detector.INFERENCE_MODEL_FILE)),
+                    reason='the trained detector model is not available')
+def test_tflite_outputs_match_keras(tmp_path):
+    keras_model = detector.get_model_from_file()
+    tflite_file = str(tmp_path / 'model_traffic_light.tflite')
+    convert_model(keras_model, tflite_file)
+    tflite_model = TFLiteModel(tflite_file)
+
+    rng = np.random.RandomState(0)
+    for _ in range(NUM_IMAGES):
+        image = rng.uniform(size=(1, detector.image_size[1], detector.image_size[0], 3))
+        with keras_model.graph.as_default():
+            reference = keras_model.predict(image)
+        assert np.max(np.abs(tflite_model.predict(image) - reference)) <= PARITY_TOLERANCE
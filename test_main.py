@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+import os
+import sys
+from math import pi
+from types import SimpleNamespace
+
+import pytest
+
+# main.py runs from the CARLA PythonClient, next to the carla package.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+pytest.importorskip('carla')
+import main
+
+def crossing_pedestrian():
+    # Pedestrian walking across the road of an ego vehicle heading along x.
+    return [(SimpleNamespace(x=10.0, y=1.0), pi / 2)]
+
+def test_predicted_motion_with_crossing_pedestrian():
+    check = [True, True, True, True, False, True, True]
+    collision, is_active_collision = main.predict_pedestrian_collisions(
+        check, crossing_pedestrian(), [0.0, 0.0, 0.0, 5.0],
+        main.DELTA_ORIENTATION, predicted_motion=True)
+    assert collision
+    assert is_active_collision == [True] * len(check)
+
+def test_crossing_pedestrian_activates_outer_paths():
+    check = [False, True, True, True, True, True, True]
+    collision, is_active_collision = main.predict_pedestrian_collisions(
+        check, crossing_pedestrian(), [0.0, 0.0, 0.0, 5.0],
+        main.DELTA_ORIENTATION)
+    assert not collision
+    assert is_active_collision == [False, True, True, True, True, True, False]
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import traffic_light_tracker
+from traffic_light_tracker import TrafficLightTrack, NO_TRAFFIC_LIGHT, MAX_DEPTH
+
+STOP = 1
+EGO_SPEED = 5.0
+DT = 0.1
+
+def test_switch_to_closer_light_restarts_track():
+    track = TrafficLightTrack()
+    track.update(STOP, 60.0, EGO_SPEED, 0.0)
+    depths = [track.update(STOP, 12.0 - EGO_SPEED*DT*i, EGO_SPEED, DT*(i + 1))
+              for i in range(3)]
+    assert abs(depths[0] - 12.0) < 1e-9
+    assert all(abs(depth - (12.0 - EGO_SPEED*DT*i)) < 0.5
+               for i, depth in enumerate(depths))
+    assert abs(track._speed_correction) <= traffic_light_tracker.TL_MAX_SPEED_CORRECTION
+
+def test_switch_to_farther_light_restarts_track():
+    track = TrafficLightTrack()
+    track.update(STOP, 4.8, EGO_SPEED, 0.0)
+    depth = track.update(STOP, 50.0, EGO_SPEED, DT)
+    assert abs(depth - 50.0) < 1e-9
+    assert track.time_to_stop_line(EGO_SPEED) > 9.0
+
+def test_speed_correction_is_bounded():
+    track = TrafficLightTrack()
+    track.update(STOP, 30.0, EGO_SPEED, 0.0)
+    for i in range(20):
+        # Measurements that stay a little behind the prediction every frame.
+        track.update(STOP, track.filtered_depth + 2.0, EGO_SPEED, DT*(i + 1))
+    assert abs(track._speed_correction) <= traffic_light_tracker.TL_MAX_SPEED_CORRECTION
+
+def test_lost_detection_far_away_is_bridged():
+    track = TrafficLightTrack()
+    track.update(STOP, 40.0, EGO_SPEED, 0.0)
+    depth = track.update(NO_TRAFFIC_LIGHT, MAX_DEPTH, EGO_SPEED, DT)
+    assert abs(depth - (40.0 - EGO_SPEED*DT)) < 1e-9
+
+def test_lost_detection_times_out():
+    track = TrafficLightTrack()
+    track.update(STOP, 40.0, EGO_SPEED, 0.0)
+    timestamp = 0.0
+    while timestamp <= traffic_light_tracker.TL_MAX_COAST_TIME:
+        timestamp += DT
+        depth = track.update(NO_TRAFFIC_LIGHT, MAX_DEPTH, EGO_SPEED, timestamp)
+    assert depth == MAX_DEPTH
+
+def test_lost_detection_close_to_light_drops_track():
+    track = TrafficLightTrack()
+    track.update(STOP, traffic_light_tracker.TL_MIN_COAST_DEPTH + 0.2, EGO_SPEED, 0.0)
+    depth = track.update(NO_TRAFFIC_LIGHT, MAX_DEPTH, EGO_SPEED, DT)
+    assert depth == MAX_DEPTH
+    assert track.last_depth == MAX_DEPTH
+    assert track.time_to_stop_line(EGO_SPEED) == float('inf')
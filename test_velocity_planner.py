@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import velocity_planner
+from planned_path import PlannedPath
+
+TIME_GAP = 1.0
+A_MAX = 2.5
+SLOW_SPEED = 2.0
+STOP_LINE_BUFFER = 3.5
+
+def straight_path(length, num_points=41):
+    x = np.linspace(0.0, length, num_points)
+    return PlannedPath(x, np.zeros_like(x), np.zeros_like(x))
+
+def stop_profile(path, unified_profile, start_speed=5.0, desired_speed=5.0):
+    planner = velocity_planner.VelocityPlanner(TIME_GAP, A_MAX, SLOW_SPEED, STOP_LINE_BUFFER,
+                                               unified_profile=unified_profile)
+    return planner.compute_velocity_profile(path, desired_speed, [0.0, 0.0, 0.0, start_speed],
+                                            start_speed, True, None, False, False)
+
+@pytest.mark.parametrize('unified_profile', [False, True])
+def test_stop_line_beyond_last_check_distance_is_ignored(unified_profile):
+    path = straight_path(2*velocity_planner.LAST_CHECK_DISTANCE)
+    profile = stop_profile(path, unified_profile)
+    assert np.allclose(profile[1:, 2], 5.0)
+
+@pytest.mark.parametrize('unified_profile', [False, True])
+def test_stop_at_close_stop_line(unified_profile):
+    path = straight_path(0.8*velocity_planner.LAST_CHECK_DISTANCE)
+    profile = stop_profile(path, unified_profile, start_speed=2.0)
+    stopped = path.s >= path.length - STOP_LINE_BUFFER
+    assert np.all(profile[stopped, 2] < 1e-3)
+    # The vehicle can always stop by the stop line with A_MAX.
+    stop_s = path.s[stopped][0]
+    ahead = ~stopped
+    ahead[0] = False
+    assert np.all(profile[ahead, 2]**2 <= 2*A_MAX*(stop_s - path.s[ahead]) + 1e-9)
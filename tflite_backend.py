@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+TensorFlow Lite inference backend for the traffic light detector.
+
+The Keras model carries a heavy per call overhead for a single 416x416 image
+on the CPU. convert_model converts the inference-only Keras graph to a
+TensorFlow Lite flatbuffer, optionally quantized to int8, and TFLiteModel runs
+it through the TensorFlow Lite interpreter behind the same predict() as the
+Keras model. The lightweight tflite_runtime package is used when installed,
+the interpreter shipped with TensorFlow otherwise.
+"""
+import numpy as np
+
+try:
+    from tflite_runtime.interpreter import Interpreter
+except ImportError:
+    import tensorflow as tf
+    Interpreter = tf.lite.Interpreter
+
+PARITY_TOLERANCE = 1e-3  # largest output difference of the float model from the Keras one
+
+
+def convert_model(model, tflite_file, quantize=False, representative_images=None):
+    """Converts a Keras model to a TensorFlow Lite model file.
+
+    args:
+        model: Inference-only Keras model (image in, output grid out).
+        tflite_file: Output .tflite file.
+        quantize: Quantize the model to int8. With representative_images the
+            activations are quantized too (full integer model), otherwise only
+            the weights are.
+        representative_images: Preprocessed images, each a batch of one image
+            of the model input size, used to calibrate the activations.
+    """
+    import tensorflow as tf
+    from keras import backend as K
+
+    converter = tf.lite.TFLiteConverter.from_session(K.get_session(),
+                                                     [model.input],
+                                                     [model.output])
+    if quantize:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if representative_images is not None:
+            converter.representative_dataset = lambda: (
+                [image.astype(np.float32)] for image in representative_images)
+    with open(tflite_file, 'wb') as f:
+        f.write(converter.convert())
+
+
+class TFLiteModel:
+    def __init__(self, tflite_file):
+        self._interpreter = Interpreter(model_path=tflite_file)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+
+    def predict(self, image):
+        """Runs the model on a batch of one preprocessed image.
+
+        args:
+            image: Array of shape (1, height, width, 3), RGB in [0, 1].
+        returns:
+            netout: Output grid, same shape and values as the Keras model.
+        """
+        image = _quantize(np.asarray(image), self._input)
+        self._interpreter.set_tensor(self._input['index'], image)
+        self._interpreter.invoke()
+        netout = self._interpreter.get_tensor(self._output['index'])
+        return _dequantize(netout, self._output)
+
+
+def _quantize(array, details):
+    # Integer tensors are fed as round(value / scale) + zero point.
+    if details['dtype'] == np.float32:
+        return array.astype(np.float32)
+    scale, zero_point = details['quantization']
+    info = np.iinfo(details['dtype'])
+    return np.clip(np.round(array / scale) + zero_point,
+                   info.min, info.max).astype(details['dtype'])
+
+
+def _dequantize(array, details):
+    if details['dtype'] == np.float32:
+        return array.copy()
+    scale, zero_point = details['quantization']
+    return (array.astype(np.float32) - zero_point) * scale
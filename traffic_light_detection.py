@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Traffic light detection in a background worker thread.
+
+The detector network is too slow to run inside of the control loop without
+stalling the steering and throttle updates. The worker consumes the latest
+camera frame from a single-slot queue (older frames that were not processed
+yet are dropped), and publishes its result stamped with the simulation time of
+the frame it was computed on, so that the planner can read the most recent
+result without blocking and judge how old it is.
+"""
+import collections
+import queue
+import threading
+import time
+
+
+class TrafficLightDetection(collections.namedtuple(
+        'TrafficLightDetection', ['label', 'box', 'timestamp', 'latency'])):
+    """Result of the detection on one camera frame.
+
+    label: Detected state [0,1,2] = [GO,STOP,NO_TRAFFIC_LIGHT].
+    box: Bounding box of the traffic light, None if there is none.
+    timestamp: Simulation time (s) of the frame the detection was run on.
+    latency: Wall time (s) taken by the detection.
+    """
+    __slots__ = ()
+
+    def age(self, timestamp):
+        """Returns how old (s) the detection is at simulation time timestamp."""
+        return timestamp - self.timestamp
+
+
+class TrafficLightDetector:
+    def __init__(self, detect_function):
+        """
+        args:
+            detect_function: Function taking a BGRA camera image and returning
+                the [label, box] of the detected traffic light.
+        """
+        self._detect_function = detect_function
+        self._frames = queue.Queue(maxsize=1)
+        self._lock = threading.Lock()
+        self._latest = None
+        self._stop = threading.Event()
+        self._stats = {'submitted': 0, 'dropped': 0, 'processed': 0,
+                       'latency': 0.0}
+        # Daemon thread, so that a detection in progress never keeps the
+        # client alive once the episode is over.
+        self._thread = threading.Thread(target=self._run,
+                                        name='traffic_light_detector',
+                                        daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def submit(self, image, timestamp):
+        """Queues a camera frame for detection, replacing the frame that is
+        still waiting, if any. Never blocks.
+
+        args:
+            image: BGRA camera image.
+            timestamp: Simulation time (s) of the frame.
+        """
+        with self._lock:
+            self._stats['submitted'] += 1
+            try:
+                self._frames.get_nowait()
+                self._stats['dropped'] += 1
+            except queue.Empty:
+                pass
+            self._frames.put_nowait((image, timestamp))
+
+    def latest(self, newer_than=None):
+        """Returns the most recent TrafficLightDetection, None until the
+        first frame has been processed. Never blocks.
+
+        args:
+            newer_than: Simulation time (s) of the last detection used by the
+                caller. The detection is only returned when it was run on a
+                later frame, so that the same result is not used twice.
+        """
+        detection = self._latest
+        if detection is None or (newer_than is not None
+                                 and detection.timestamp <= newer_than):
+            return None
+        return detection
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                image, timestamp = self._frames.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            start = time.time()
+            label, box = self._detect_function(image)
+            latency = time.time() - start
+            self._latest = TrafficLightDetection(label, box, timestamp, latency)
+            with self._lock:
+                self._stats['processed'] += 1
+                self._stats['latency'] += latency
+
+    def get_stats(self):
+        """Returns the number of submitted, dropped and processed frames and
+        the mean detection latency (s)."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['mean_latency'] = stats.pop('latency') / max(stats['processed'], 1)
+        return stats
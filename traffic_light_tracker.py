@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+import numpy as np
+
+TL_HISTORY_SIZE = 8       # number of past frames kept (longest window used by the FSM is 7)
+NO_TRAFFIC_LIGHT = 2      # traffic light state when nothing is detected
+MAX_DEPTH = 1000          # depth in meters when there is no traffic light
+TL_DEPTH_ALPHA = 0.5      # alpha-beta filter gain on the depth
+TL_DEPTH_BETA = 0.1       # alpha-beta filter gain on the closing speed correction
+TL_MAX_COAST_TIME = 1.0   # seconds the track is predicted through frames without detection
+TL_MIN_COAST_DEPTH = 10.0 # m, below this depth the track is dropped instead of predicted
+TL_GATE_DISTANCE = 4.0    # m, smallest residual that restarts the track on a new traffic light
+TL_GATE_FACTOR = 2.0      # residual gate as a multiple of the expected motion over the frame
+TL_MAX_SPEED_CORRECTION = 3.0  # m/s, bound of the closing speed correction
+TL_DEBOUNCE_FRAMES = 2    # consecutive frames needed to switch the debounced state
+MIN_SPEED = 0.1           # m/s, lowest speed used for the time to the stop line
+
+
+class TrafficLightTrack:
+    """Track of the traffic light ahead of the ego vehicle.
+
+    Keeps the last TL_HISTORY_SIZE detected states and filtered depths in
+    fixed-size ring buffers, and filters the depth with an alpha-beta filter
+    whose prediction step assumes the traffic light is static, i.e. that the
+    depth decreases with the ego speed. The beta term learns a correction of
+    that closing speed (e.g. when the road is not straight). Frames without a
+    detection are bridged with the prediction for up to TL_MAX_COAST_TIME, as
+    long as the traffic light is farther than TL_MIN_COAST_DEPTH. A residual
+    larger than the gate means the detection is another traffic light, and the
+    track restarts from it.
+    """
+    def __init__(self, history_size=TL_HISTORY_SIZE):
+        self._states = np.full(history_size, NO_TRAFFIC_LIGHT, dtype=int)
+        self._depths = np.full(history_size, float(MAX_DEPTH))
+        self._index = 0
+        self._count = 0
+
+        self._depth = float(MAX_DEPTH)
+        self._speed_correction = 0.0
+        self._active = False
+        self._coast_time = 0.0
+        self._timestamp = None
+
+        self._debounced_state = NO_TRAFFIC_LIGHT
+        self._candidate_state = NO_TRAFFIC_LIGHT
+        self._candidate_count = 0
+
+    def update(self, tl_state, tl_depth, ego_speed, timestamp=None):
+        """Updates the track with the detection of the current frame.
+
+        args:
+            tl_state: Detected traffic light state [0,1,2] = [GO,STOP,NO_TRAFFIC_LIGHT].
+            tl_depth: Measured depth (m) of the traffic light, MAX_DEPTH if none.
+            ego_speed: Speed (m/s) of the ego vehicle.
+            timestamp: Time (s) of the frame. Without it the filter does not
+                predict the depth between frames.
+        returns:
+            filtered_depth: Filtered depth (m) of the traffic light, MAX_DEPTH
+                if there is no track.
+        """
+        dt = 0.0
+        if timestamp is not None and self._timestamp is not None:
+            dt = max(timestamp - self._timestamp, 0.0)
+        self._timestamp = timestamp
+
+        detected = tl_state != NO_TRAFFIC_LIGHT and tl_depth < MAX_DEPTH
+        if self._active:
+            # Predict: a static traffic light gets closer with the ego speed.
+            closing_speed = ego_speed + self._speed_correction
+            predicted = max(self._depth - closing_speed * dt, 0.0)
+            gate = max(TL_GATE_DISTANCE, TL_GATE_FACTOR * abs(ego_speed) * dt)
+            if detected and abs(tl_depth - predicted) > gate:
+                self._start(tl_depth)
+            elif detected:
+                residual = tl_depth - predicted
+                self._depth = predicted + TL_DEPTH_ALPHA * residual
+                if dt > 0.0:
+                    self._speed_correction = np.clip(
+                        self._speed_correction - TL_DEPTH_BETA * residual / dt,
+                        -TL_MAX_SPEED_CORRECTION, TL_MAX_SPEED_CORRECTION)
+                self._coast_time = 0.0
+            else:
+                # Close to the traffic light a missed detection is not
+                # bridged, the prediction would run the depth down to zero.
+                self._depth = predicted
+                self._coast_time += dt
+                if (self._coast_time > TL_MAX_COAST_TIME
+                        or predicted < TL_MIN_COAST_DEPTH):
+                    self._active = False
+        elif detected:
+            self._start(tl_depth)
+
+        if not self._active:
+            self._depth = float(MAX_DEPTH)
+
+        self._states[self._index] = tl_state
+        self._depths[self._index] = self._depth
+        self._index = (self._index + 1) % len(self._states)
+        self._count = min(self._count + 1, len(self._states))
+        self._update_debounced_state(tl_state)
+
+        return self._depth
+
+    def _start(self, tl_depth):
+        self._active = True
+        self._depth = float(tl_depth)
+        self._speed_correction = 0.0
+        self._coast_time = 0.0
+
+    def _update_debounced_state(self, tl_state):
+        if tl_state == self._candidate_state:
+            self._candidate_count += 1
+        else:
+            self._candidate_state = tl_state
+            self._candidate_count = 1
+        if self._candidate_count >= TL_DEBOUNCE_FRAMES:
+            self._debounced_state = self._candidate_state
+
+    @property
+    def filtered_depth(self):
+        return self._depth
+
+    @property
+    def debounced_state(self):
+        return self._debounced_state
+
+    @property
+    def last_depth(self):
+        return self._depths[self._index - 1] if self._count > 0 else float(MAX_DEPTH)
+
+    def time_to_stop_line(self, ego_speed):
+        """Returns the predicted time (s) to reach the traffic light at the
+        current speed, inf if there is no track."""
+        if not self._active:
+            return float('inf')
+        return self._depth / max(ego_speed + self._speed_correction, MIN_SPEED)
+
+    def recent_states_are(self, tl_state, frames):
+        """Returns true if each of the last frames states was tl_state."""
+        if self._count < frames:
+            return False
+        indices = (self._index - 1 - np.arange(frames)) % len(self._states)
+        return bool(np.all(self._states[indices] == tl_state))
+
+    def recent_depths_within(self, distance, frames):
+        """Returns true if there are at least frames depths and one of the
+        last frames filtered depths is within distance (m)."""
+        if self._count < frames:
+            return False
+        indices = (self._index - 1 - np.arange(frames)) % len(self._depths)
+        return bool(np.any(self._depths[indices] <= distance))
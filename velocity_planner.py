@@ -1,51 +1,55 @@
 #!/usr/bin/env python3
 import numpy as np
-from math import sin, cos, pi, sqrt
+from math import sqrt
+from planned_path import PlannedPath, path_curvature
 LAST_CHECK_DISTANCE=7
+JERK_SAMPLES=100 # time samples of the jerk limited acceleration from the start speed
+MIN_PROFILE_SPEED=1e-3 # m/s, mean segment speed below which the profile is stopped
 class VelocityPlanner:
-    def __init__(self, time_gap, a_max, slow_speed, stop_line_buffer):
+    def __init__(self, time_gap, a_max, slow_speed, stop_line_buffer,
+                 a_lat_max=None, unified_profile=False, j_max=None):
         self._time_gap         = time_gap
         self._a_max            = a_max
         self._slow_speed       = slow_speed
         self._stop_line_buffer = stop_line_buffer
-        self._prev_trajectory  = [[0.0, 0.0, 0.0]]
+        self._a_lat_max        = a_lat_max
+        self._unified_profile  = unified_profile
+        self._j_max            = j_max
+        self._prev_trajectory  = np.zeros((1, 3))
+        self._prev_times       = np.zeros(1)
 
     # Computes an open loop speed estimate based on the previously planned
     # trajectory, and the timestep since the last planning cycle.
     # Input: timestep is in seconds
     def get_open_loop_speed(self, timestep):
-        if len(self._prev_trajectory) == 1:
-            return self._prev_trajectory[0][2] 
-        
-        # If simulation time step is zero, give the start of the trajectory as the
-        # open loop estimate.
-        if timestep < 1e-4:
-            return self._prev_trajectory[0][2]
-
-        for i in range(len(self._prev_trajectory)-1):
-            distance_step = np.linalg.norm(np.subtract(self._prev_trajectory[i+1][0:2], 
-                                                       self._prev_trajectory[i][0:2]))
-            velocity = self._prev_trajectory[i][2]
-            time_delta = distance_step / velocity
-           
-            # If time_delta exceeds the remaining time in our simulation timestep, 
-            # interpolate between the velocity of the current step and the velocity
-            # of the next step to estimate the open loop velocity.
-            if time_delta > timestep:
-                v1 = self._prev_trajectory[i][2]
-                v2 = self._prev_trajectory[i+1][2]
-                v_delta = v2 - v1
-                interpolation_ratio = timestep / time_delta
-
-                return v1 + interpolation_ratio * v_delta
-
-            # Otherwise, keep checking.
-            else:
-                timestep -= time_delta
+        # If simulation time step is zero, this gives the start of the
+        # trajectory as the open loop estimate, and if it exceeds the length
+        # of the path, which means we have likely stopped, the end velocity of
+        # the trajectory.
+        return float(self.get_speed_at_time(timestep))
+
+    # Looks up the speed of the previously planned trajectory at any time
+    # after the start of the trajectory, from the time stamps stored with it.
+    def get_speed_at_time(self, t):
+        """Returns the planned speed at time t.
 
-        # Simulation time step exceeded the length of the path, which means we have likely
-        # stopped. Return the end velocity of the trajectory.
-        return self._prev_trajectory[-1][2]
+        args:
+            t: time (s) since the start of the planned trajectory, a number or
+                an array of times.
+        returns:
+            speed: speed (m/s) at time t, linearly interpolated between the
+                points of the trajectory. Past the last point, or past a point
+                where the trajectory stops, the speed of that point.
+        """
+        times = self._prev_times
+        speeds = self._prev_trajectory[:, 2]
+        t = np.maximum(t, 0.0)
+        i = np.minimum(np.searchsorted(times, t, side='right') - 1, len(times) - 1)
+        j = np.minimum(i + 1, len(times) - 1)
+        span = times[j] - times[i]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = np.where(np.isfinite(span) & (span > 0), (t - times[i]) / span, 0.0)
+        return speeds[i] + ratio * (speeds[j] - speeds[i])
 
     # Takes a path, and computes a velocity profile to our desired speed.
     # - decelerate_to_stop denotes whether or not we need to decelerate to a
@@ -57,6 +61,8 @@ class VelocityPlanner:
     # planner you would need to handle the coupling between these states, but
     # for simplicity this project can be implemented by isolating each case.
     # For all profiles, the required acceleration is given by self._a_max.
+    # With unified_profile, the cases are instead coupled as speed limits along
+    # the path, and a single minimum time profile meets all of them.
     # Recall that the path is of the form [x_points, y_points, t_points].
     def compute_velocity_profile(self, path, desired_speed, ego_state, 
                                  closed_loop_speed, decelerate_to_stop, 
@@ -95,10 +101,14 @@ class VelocityPlanner:
             self._a_max: maximum acceleration/deceleration of the vehicle (m/s^2)
             self._time_gap: Amount of time taken to reach the lead vehicle from
                 the current position
+            self._a_lat_max: maximum lateral acceleration (m/s^2) in the turns
+                of the path, if not None
+            self._unified_profile: Compute the optimal_profile of the
+                speed_limits instead of the profile of a single case
         returns:
             profile: Updated profile which contains the local path as well as
                 the speed to be tracked by the controller (global frame).
-                Length and speed in m and m/s.
+                Length and speed in m and m/s, as an (m, 3) array.
                 Format: [[x0, y0, v0],
                          [x1, y1, v1],
                          ...,
@@ -110,19 +120,21 @@ class VelocityPlanner:
                     profile[5]:
                     returns [x5, y5, v5] (6th point in the local path)
         """
-        profile = []
         # For our profile, use the open loop speed as our initial speed.
         start_speed = ego_state[3]
 
-        if emergency_brake:
+        if self._unified_profile:
+            limits = self.speed_limits(path, ego_state, desired_speed,
+                                       decelerate_to_stop, lead_car_state,
+                                       follow_lead_vehicle, emergency_brake)
+            profile = self.optimal_profile(path, start_speed, limits)
+        elif emergency_brake:
             desired_speed=0.0
             profile = self.nominal_profile(path, start_speed, desired_speed)
         # check if the ego_vehicle is in TRAFFICLIGHT_STOP state
         elif decelerate_to_stop:
             #compute the distance between ego_vehicle and the traffic light goal_state
-            end_x,end_y=path[-1][0],path[-1][1]
-            my_x,my_y=ego_state[0],ego_state[1]
-            dist=np.sqrt((end_x-my_x)**2+(end_y-my_y)**2)
+            dist=stop_line_distance(path, ego_state)
             #if the distance is less than LAST_CHECK_DISTANCE generate a trapezoidal profile to decelerate
             if dist>=LAST_CHECK_DISTANCE:
                 profile = self.nominal_profile(path, start_speed, desired_speed)
@@ -138,18 +150,21 @@ class VelocityPlanner:
         else:
             profile = self.nominal_profile(path, start_speed, desired_speed)
 
+        # Slow down ahead of the turns of the path, so that the lateral
+        # acceleration stays within a_lat_max.
+        if self._a_lat_max is not None and not self._unified_profile:
+            profile[:, 2] = np.minimum(profile[:, 2], self.curvature_profile(path))
+
         # Interpolate between the zeroth state and the first state.
         # This prevents the myopic controller from getting stuck at the zeroth
         # state.
         if len(profile) > 1:
-            interpolated_state = [(profile[1][0] - profile[0][0]) * 0.1 + profile[0][0], 
-                                  (profile[1][1] - profile[0][1]) * 0.1 + profile[0][1], 
-                                  (profile[1][2] - profile[0][2]) * 0.1 + profile[0][2]]
-            del profile[0]
-            profile.insert(0, interpolated_state)
+            profile[0] += (profile[1] - profile[0]) * 0.1
 
-        # Save the planned profile for open loop speed estimation.
+        # Save the planned profile and the time at which each of its points
+        # is reached, for open loop speed estimation.
         self._prev_trajectory = profile
+        self._prev_times = profile_times(profile)
 
         return profile
 
@@ -177,7 +192,7 @@ class VelocityPlanner:
         returns:
             profile: deceleration profile which contains the local path as well
                 as the speed to be tracked by the controller (global frame).
-                Length and speed in m and m/s.
+                Length and speed in m and m/s, as an (m, 3) array.
                 Format: [[x0, y0, v0],
                          [x1, y1, v1],
                          ...,
@@ -189,9 +204,10 @@ class VelocityPlanner:
                     profile[5]:
                     returns [x5, y5, v5] (6th point in the local path)
         """
-        profile          = []
         slow_speed       = self._slow_speed
         stop_line_buffer = self._stop_line_buffer
+        x, y, s = path_arc_length(path)
+        path_length = s[-1]
 
         # Using d = (v_f^2 - v_i^2) / (2 * a), compute the two distances
         # used in the trapezoidal stop behaviour. decel_distance goes from
@@ -200,108 +216,57 @@ class VelocityPlanner:
         decel_distance = calc_distance(start_speed, slow_speed, -self._a_max)
         brake_distance = calc_distance(slow_speed, 0, -self._a_max)
 
-        # compute total path length
-        path_length = 0.0
-        for i in range(len(path[0])-1):
-            path_length += np.linalg.norm([path[0][i+1] - path[0][i], 
-                                           path[1][i+1] - path[1][i]])
-
-        stop_index = len(path[0]) - 1
-        temp_dist = 0.0
-        # Compute the index at which we should stop.
-        while (stop_index > 0) and (temp_dist < stop_line_buffer):
-            temp_dist += np.linalg.norm([path[0][stop_index] - path[0][stop_index-1], 
-                                         path[1][stop_index] - path[1][stop_index-1]])
-            stop_index -= 1
+        # The index at which we should stop is the last one at least
+        # stop_line_buffer away from the end of the path.
+        stop_index = max(np.searchsorted(s, path_length - stop_line_buffer, side='right') - 1, 0)
 
+        speeds = np.zeros(len(s))
         # If the brake distance exceeds the length of the path, then we cannot
         # perform a smooth deceleration and require a harder deceleration. Build
         # the path up in reverse to ensure we reach zero speed at the required
-        # time.
+        # time. The speeds past the stop line buffer are zero.
         if brake_distance + decel_distance + stop_line_buffer > path_length:
-            speeds = []
-            vf = 0.0
-            # The speeds past the stop line buffer should be zero.
-            for i in reversed(range(stop_index, len(path[0]))):
-                speeds.insert(0, 0.0)
-            # The rest of the speeds should be a linear ramp from zero,
-            # decelerating at -self._a_max.
-            for i in reversed(range(stop_index)):
-                dist = np.linalg.norm([path[0][i+1] - path[0][i], 
-                                       path[1][i+1] - path[1][i]])
-                vi = calc_final_speed(vf, -self._a_max, dist)
-                # We don't want to have points above the starting speed
-                # along our profile, so clamp to start_speed.
-                if vi > start_speed:
-                    vi = start_speed
-
-                speeds.insert(0, vi)
-                vf = vi
-
-            # Generate the profile, given the computed speeds.
-            for i in range(len(speeds)):
-                profile.append([path[0][i], path[1][i], speeds[i]])
-            
+            speeds[:stop_index] = calc_final_speeds(0.0, -self._a_max,
+                                                    s[stop_index] - s[:stop_index])
+            # We don't want to have points above the starting speed
+            # along our profile, so clamp to start_speed.
+            speeds[:stop_index] = np.minimum(speeds[:stop_index], start_speed)
+
         # Otherwise, we will perform a full trapezoidal profile. The
         # brake_index will be the index of the path at which we start
         # braking, and the decel_index will be the index at which we stop
         # decelerating to our slow_speed. These two indices denote the
         # endpoints of the ramps in our trapezoidal profile.
         else:
-            brake_index = stop_index 
-            temp_dist = 0.0
-            # Compute the index at which to start braking down to zero.
-            while (brake_index > 0) and (temp_dist < brake_distance):
-                temp_dist += np.linalg.norm([path[0][brake_index] - path[0][brake_index-1], 
-                                             path[1][brake_index] - path[1][brake_index-1]])
-                brake_index -= 1
-
-            # Compute the index to stop decelerating to the slow speed.  This is
-            # done by stepping through the points until accumulating
-            # decel_distance of distance to said index, starting from the the
-            # start of the path.       
-            decel_index = 0
-            temp_dist = 0.0
-            while (decel_index < brake_index) and (temp_dist < decel_distance):
-                temp_dist += np.linalg.norm([path[0][decel_index+1] - path[0][decel_index], 
-                                             path[1][decel_index+1] - path[1][decel_index]])
-                decel_index += 1
-
-            # The speeds from the start to decel_index should be a linear ramp
+            # Start braking down to zero at the last index at least
+            # brake_distance before the stop index.
+            brake_index = np.searchsorted(s, s[stop_index] - brake_distance, side='right') - 1
+            brake_index = min(max(brake_index, 0), stop_index)
+            # Stop decelerating to the slow speed at the first index at least
+            # decel_distance from the start of the path.
+            decel_index = min(np.searchsorted(s, decel_distance, side='left'), brake_index)
+
+            # The speeds from the start to decel_index are a linear ramp
             # from the current speed down to the slow_speed, decelerating at
-            # -self._a_max.
-            vi = start_speed
-            for i in range(decel_index): 
-                dist = np.linalg.norm([path[0][i+1] - path[0][i], 
-                                       path[1][i+1] - path[1][i]])
-                vf = calc_final_speed(vi, -self._a_max, dist)
-                # We don't want to overshoot our slow_speed, so clamp it to that.
-                if vf < slow_speed:
-                    vf = slow_speed
-
-                profile.append([path[0][i], path[1][i], vi])
-                vi = vf
+            # -self._a_max. We don't want to overshoot our slow_speed, so clamp
+            # it to that.
+            ramp = np.maximum(calc_final_speeds(start_speed, -self._a_max, s[:decel_index + 1]),
+                              slow_speed)
+            ramp[0] = start_speed
+            speeds[:decel_index] = ramp[:decel_index]
 
             # In this portion of the profile, we are maintaining our slow_speed.
-            for i in range(decel_index, brake_index):
-                profile.append([path[0][i], path[1][i], vi])
-                
-            # The speeds from the brake_index to stop_index should be a
-            # linear ramp from the slow_speed down to the 0, decelerating at
-            # -self._a_max.
-            for i in range(brake_index, stop_index):
-                dist = np.linalg.norm([path[0][i+1] - path[0][i], 
-                                       path[1][i+1] - path[1][i]])
-                vf = calc_final_speed(vi, -self._a_max, dist)
-                profile.append([path[0][i], path[1][i], vi])
-                vi = vf
+            coast_speed = ramp[decel_index]
+            speeds[decel_index:brake_index] = coast_speed
 
+            # The speeds from the brake_index to stop_index are a linear ramp
+            # from the slow_speed down to the 0, decelerating at -self._a_max.
             # The rest of the profile consists of our stop_line_buffer, so
             # it contains zero speed for all points.
-            for i in range(stop_index, len(path[0])):
-                profile.append([path[0][i], path[1][i], 0.0])
+            speeds[brake_index:stop_index] = calc_final_speeds(
+                coast_speed, -self._a_max, s[brake_index:stop_index] - s[brake_index])
 
-        return profile
+        return np.column_stack((x, y, speeds))
 
     # Computes a profile for following a lead vehicle..
     def follow_profile(self, path, start_speed, desired_speed, lead_car_state):
@@ -330,7 +295,7 @@ class VelocityPlanner:
             profile: Updated follow vehicle profile which contains the local
                 path as well as the speed to be tracked by the controller 
                 (global frame).
-                Length and speed in m and m/s.
+                Length and speed in m and m/s, as an (m, 3) array.
                 Format: [[x0, y0, v0],
                          [x1, y1, v1],
                          ...,
@@ -342,58 +307,34 @@ class VelocityPlanner:
                     profile[5]:
                     returns [x5, y5, v5] (6th point in the local path)
         """
-        profile = []
+        x, y, s = path_arc_length(path)
+
         # Find the closest point to the lead vehicle on our planned path.
-        min_index = len(path[0]) - 1
-        min_dist = float('Inf')
-        for i in range(len(path)):
-            dist = np.linalg.norm([path[0][i] - lead_car_state[0], 
-                                   path[1][i] - lead_car_state[1]])
-            if dist < min_dist:
-                min_dist = dist
-                min_index = i
+        lead_dists = np.hypot(x - lead_car_state[0], y - lead_car_state[1])
+        min_index = int(np.argmin(lead_dists))
+        min_dist = lead_dists[min_index]
 
         # Compute the time gap point, assuming our velocity is held constant at
         # the minimum of the desired speed and the ego vehicle's velocity, from
-        # the closest point to the lead vehicle on our planned path.
+        # the closest point to the lead vehicle on our planned path: the last
+        # point at least distance_gap away from the lead vehicle along the path.
         desired_speed = min(lead_car_state[2], desired_speed)
-        ramp_end_index = min_index
-        distance = min_dist
         distance_gap = desired_speed * self._time_gap
-        while (ramp_end_index > 0) and (distance > distance_gap):
-            distance += np.linalg.norm([path[0][ramp_end_index] - path[0][ramp_end_index-1], 
-                                        path[1][ramp_end_index] - path[1][ramp_end_index-1]])
-            ramp_end_index -= 1
+        ramp_end_index = np.searchsorted(s, s[min_index] + min_dist - distance_gap, side='right') - 1
+        ramp_end_index = min(max(ramp_end_index, 0), min_index)
 
         # We now need to reach the ego vehicle's speed by the time we reach the
         # time gap point, ramp_end_index, which therefore is the end of our ramp
-        # velocity profile.
-        if desired_speed < start_speed:
-            decel_distance = calc_distance(start_speed, desired_speed, -self._a_max)
-        else:
-            decel_distance = calc_distance(start_speed, desired_speed, self._a_max)
-
-        # Here we will compute the speed profile from our initial speed to the
-        # end of the ramp.
-        vi = start_speed
-        for i in range(ramp_end_index + 1):
-            dist = np.linalg.norm([path[0][i+1] - path[0][i], 
-                                   path[1][i+1] - path[1][i]])
-            if desired_speed < start_speed:
-                vf = calc_final_speed(vi, -self._a_max, dist)
-            else:
-                vf = calc_final_speed(vi, self._a_max, dist)
-
-            profile.append([path[0][i], path[1][i], vi])
-            vi = vf
+        # velocity profile. Here we will compute the speed profile from our
+        # initial speed to the end of the ramp.
+        a = -self._a_max if desired_speed < start_speed else self._a_max
+        speeds = np.full(len(s), float(desired_speed))
+        speeds[:ramp_end_index + 1] = calc_final_speeds(start_speed, a, s[:ramp_end_index + 1])
 
         # Once we hit the time gap point, we need to be at the desired speed.
         # If we can't get there using a_max, do an abrupt change in the profile
         # to use the controller to decelerate more quickly.
-        for i in range(ramp_end_index + 1, len(path[0])):
-            profile.append([path[0][i], path[1][i], desired_speed])
-
-        return profile
+        return np.column_stack((x, y, speeds))
 
     # Computes a profile for nominal speed tracking.
     def nominal_profile(self, path, start_speed, desired_speed):
@@ -416,7 +357,7 @@ class VelocityPlanner:
         returns:
             profile: Updated nominal speed profile which contains the local path
                 as well as the speed to be tracked by the controller (global frame).
-                Length and speed in m and m/s.
+                Length and speed in m and m/s, as an (m, 3) array.
                 Format: [[x0, y0, v0],
                          [x1, y1, v1],
                          ...,
@@ -428,7 +369,8 @@ class VelocityPlanner:
                     profile[5]:
                     returns [x5, y5, v5] (6th point in the local path)
         """
-        profile = []
+        x, y, s = path_arc_length(path)
+
         # Compute distance travelled from start speed to desired speed using
         # a constant acceleration.
         if desired_speed < start_speed:
@@ -436,40 +378,164 @@ class VelocityPlanner:
         else:
             accel_distance = calc_distance(start_speed, desired_speed, self._a_max)
 
-        # Here we will compute the end of the ramp for our velocity profile.
-        # At the end of the ramp, we will maintain our final speed.
-        ramp_end_index = 0
-        distance = 0.0
-        while (ramp_end_index < len(path[0])-1) and (distance < accel_distance):
-            distance += np.linalg.norm([path[0][ramp_end_index+1] - path[0][ramp_end_index], 
-                                        path[1][ramp_end_index+1] - path[1][ramp_end_index]])
-            ramp_end_index += 1
-
-        # Here we will actually compute the velocities along the ramp.
-        vi = start_speed
-        for i in range(ramp_end_index):
-            dist = np.linalg.norm([path[0][i+1] - path[0][i], 
-                                   path[1][i+1] - path[1][i]])
-            if desired_speed < start_speed:
-                vf = calc_final_speed(vi, -self._a_max, dist)
-                # clamp speed to desired speed
-                if vf < desired_speed:
-                    vf = desired_speed
-            else:
-                vf = calc_final_speed(vi, self._a_max, dist)
-                # clamp speed to desired speed
-                if vf > desired_speed:
-                    vf = desired_speed
+        # Here we will compute the end of the ramp for our velocity profile,
+        # the first point at least accel_distance along the path.
+        ramp_end_index = np.searchsorted(s, accel_distance, side='left')
 
-            profile.append([path[0][i], path[1][i], vi])
-            vi = vf
+        # Here we will actually compute the velocities along the ramp, clamped
+        # to the desired speed.
+        if desired_speed < start_speed:
+            speeds = np.maximum(calc_final_speeds(start_speed, -self._a_max, s), desired_speed)
+        else:
+            speeds = np.minimum(calc_final_speeds(start_speed, self._a_max, s), desired_speed)
 
         # If the ramp is over, then for the rest of the profile we should
         # track the desired speed.
-        for i in range(ramp_end_index+1, len(path[0])):
-            profile.append([path[0][i], path[1][i], desired_speed])
+        speeds[ramp_end_index:] = desired_speed
 
-        return profile
+        return np.column_stack((x, y, speeds))
+
+    # Computes the highest speeds along the path which keep the lateral
+    # acceleration within a_lat_max, and which can be reached and left again
+    # with a_max.
+    def curvature_profile(self, path):
+        """Computes the curvature speed limit of the local planner path.
+
+        args:
+            path: Path (global frame) that the vehicle will follow, in the
+                [x_points, y_points, t_points] format or a PlannedPath, which
+                already holds its curvature.
+        internal parameters of interest:
+            self._a_lat_max: maximum lateral acceleration (m/s^2)
+            self._a_max: maximum acceleration/deceleration of the vehicle (m/s^2)
+            self._slow_speed: lowest speed limit (m/s) in the turns
+        returns:
+            speeds: array of the speed limit (m/s) at each point of the path,
+                inf where the path is straight.
+        """
+        _, _, s = path_arc_length(path)
+        return reachable_speeds(self.curvature_limits(path), s, self._a_max)
+
+    # Computes the speed limit of each point of the path from its curvature
+    # alone.
+    def curvature_limits(self, path):
+        """Computes sqrt(a_lat_max / |k|) at each point of the path, never
+        below the coasting speed so that a kink in the path does not stop the
+        vehicle, and inf where the path is straight.
+        """
+        if isinstance(path, PlannedPath):
+            s, curvature = path.s, path.curvature
+        else:
+            _, _, s = path_arc_length(path)
+            curvature = path_curvature(np.asarray(path[2][:len(s)], dtype=float), np.diff(s))
+
+        # v^2 * |k| <= a_lat_max
+        abs_curvature = np.abs(curvature)
+        limits = np.full(len(s), np.inf)
+        curved = abs_curvature > 1e-6
+        limits[curved] = np.maximum(np.sqrt(self._a_lat_max / abs_curvature[curved]),
+                                    self._slow_speed)
+        return limits
+
+    # Gathers every constraint on the speed along the path as a speed limit
+    # at each point: the desired speed, the stop line, the lead vehicle, the
+    # emergency stop and the turns of the path.
+    def speed_limits(self, path, ego_state, desired_speed, decelerate_to_stop,
+                     lead_car_state, follow_lead_vehicle, emergency_brake):
+        """Computes the speed limit at each point of the local planner path.
+
+        args:
+            path: Path (global frame) that the vehicle will follow, in the
+                [x_points, y_points, t_points] format or a PlannedPath.
+                It is assumed that the stop line is at the end of the path.
+            ego_state: ego state vector for the vehicle, in the global frame.
+                format: [ego_x, ego_y, ego_yaw, ego_open_loop_speed], the
+                open loop speed being the start speed of the profile.
+            desired_speed: speed which the vehicle should reach (m/s)
+            decelerate_to_stop: Flag where if true, should stop at the stop
+                line once it is closer than LAST_CHECK_DISTANCE, as in
+                compute_velocity_profile
+            lead_car_state: the lead vehicle current state.
+                Format: [lead_car_x, lead_car_y, lead_car_speed]
+            follow_lead_vehicle: If true, the ego car should be at the speed
+                of the lead vehicle from the time gap point onwards.
+            emergency_brake: If true, the ego car should stop as soon as it
+                can with self._a_max.
+        returns:
+            limits: array of the speed limit (m/s) at each point of the path.
+                The desired speed is only a limit from where it can be
+                reached by decelerating with self._a_max; the other limits
+                are hard, and exceeding them at the start speed makes the
+                profile brake harder than self._a_max.
+        """
+        x, y, s = path_arc_length(path)
+        start_speed = ego_state[3]
+
+        # The desired speed, above which the vehicle only goes while it is
+        # still decelerating from a higher start speed.
+        limits = np.maximum(float(desired_speed),
+                            calc_final_speeds(start_speed, -self._a_max, s))
+
+        # Stop at the last point at least stop_line_buffer away from the end
+        # of the path, once the stop line is close.
+        if decelerate_to_stop and stop_line_distance(path, ego_state) < LAST_CHECK_DISTANCE:
+            stop_index = max(np.searchsorted(s, s[-1] - self._stop_line_buffer, side='right') - 1, 0)
+            limits[stop_index:] = 0.0
+
+        # Be at the speed of the lead vehicle from the time gap point on, as
+        # in follow_profile.
+        if lead_car_state is not None and follow_lead_vehicle:
+            lead_dists = np.hypot(x - lead_car_state[0], y - lead_car_state[1])
+            min_index = int(np.argmin(lead_dists))
+            lead_speed = min(lead_car_state[2], desired_speed)
+            distance_gap = lead_speed * self._time_gap
+            gap_index = np.searchsorted(s, s[min_index] + lead_dists[min_index] - distance_gap,
+                                        side='right') - 1
+            gap_index = min(max(gap_index, 0), min_index)
+            limits[gap_index:] = np.minimum(limits[gap_index:], lead_speed)
+
+        # Be stopped from the stopping distance at self._a_max on.
+        if emergency_brake:
+            limits[s >= calc_distance(start_speed, 0.0, -self._a_max)] = 0.0
+
+        if self._a_lat_max is not None:
+            limits = np.minimum(limits, self.curvature_limits(path))
+        return limits
+
+    # Computes the minimum time profile below a set of speed limits, with one
+    # backward pass for braking and one forward pass for accelerating.
+    def optimal_profile(self, path, start_speed, limits):
+        """Computes the fastest velocity profile which respects the speed
+        limits along the local planner path.
+
+        args:
+            path: Path (global frame) that the vehicle will follow, in the
+                [x_points, y_points, t_points] format or a PlannedPath.
+            start_speed: speed which the vehicle starts with (m/s)
+            limits: array of the speed limit (m/s) at each point of the path,
+                see speed_limits.
+        internal parameters of interest:
+            self._a_max: maximum acceleration/deceleration of the vehicle (m/s^2)
+            self._j_max: maximum jerk (m/s^3) when accelerating from the start
+                speed, if not None. Braking is never jerk limited.
+        returns:
+            profile: Updated profile which contains the local path as well as
+                the speed to be tracked by the controller (global frame).
+                Length and speed in m and m/s, as an (m, 3) array.
+                Format: [[x0, y0, v0],
+                         [x1, y1, v1],
+                         ...,
+                         [xm, ym, vm]]
+        """
+        x, y, s = path_arc_length(path)
+        # The profile starts at the start speed, unless a limit is lower.
+        limits = np.array(limits, dtype=float)
+        limits[0] = min(limits[0], start_speed)
+        if self._j_max is not None:
+            limits = np.minimum(limits, jerk_limited_speeds(start_speed, s, self._a_max,
+                                                            self._j_max))
+        speeds = reachable_speeds(limits, s, self._a_max)
+        return np.column_stack((x, y, speeds))
 
 # Using d = (v_f^2 - v_i^2) / (2 * a), compute the distance
 # required for a given acceleration/deceleration.
@@ -508,3 +574,117 @@ def calc_final_speed(v_i, a, d):
     if temp < 0: return 0.0000001
     else: return sqrt(temp)
 
+# Vectorized calc_final_speed, for an array of distances.
+def calc_final_speeds(v_i, a, d):
+    """Computes the final speeds given an initial speed, the distances
+    travelled, and a constant acceleration.
+
+    args:
+        v_i: initial speed (m/s)
+        a: acceleration (m/s^2)
+        d: array of distances to be travelled (m)
+    returns:
+        v_f: array of the final speeds (m/s)
+    """
+    temp = v_i*v_i + 2*np.asarray(d)*a
+    return np.where(temp < 0, 0.0000001, np.sqrt(np.maximum(temp, 0.0)))
+
+# Integrates the time at which each point of a profile is reached, assuming a
+# constant acceleration between the points: dt = 2*ds / (v_i + v_i+1).
+def profile_times(profile, min_speed=MIN_PROFILE_SPEED):
+    """Computes the time stamps of a velocity profile.
+
+    args:
+        profile: array of the [x, y, v] points of the profile.
+        min_speed: segments whose mean speed (m/s) is below min_speed are
+            never left, the vehicle stops there.
+    returns:
+        times: array of the time (s) at which each point is reached, 0 at the
+            first point, inf from the first point after a stop on.
+    """
+    profile = np.asarray(profile, dtype=float)
+    ds = np.hypot(np.diff(profile[:, 0]), np.diff(profile[:, 1]))
+    mean_speed = (profile[:-1, 2] + profile[1:, 2]) / 2
+    moving = mean_speed >= min_speed
+    dt = np.where(ds > 0, np.inf, 0.0)
+    dt[moving] = ds[moving] / mean_speed[moving]
+    return np.concatenate(([0.0], np.cumsum(dt)))
+
+# Lowers a set of speed limits along a path so that consecutive limits can be
+# met with a constant acceleration of at most a, with one backward pass (brake
+# ahead of a limit) and one forward pass (accelerate after a limit).
+def reachable_speeds(limits, s, a):
+    """Computes the highest speeds below the limits which change by at most
+    the acceleration a between the points.
+
+    Both passes work on the squared speeds, where v_i^2 <= v_j^2 + 2a|s_j - s_i|
+    for every pair of points, so that each pass is a cumulative minimum.
+
+    args:
+        limits: array of the speed limits (m/s) at each point, inf for none.
+        s: array of the arc length (m) of each point.
+        a: maximum acceleration/deceleration (m/s^2)
+    returns:
+        speeds: array of the speeds (m/s), at most the limits.
+    """
+    squared = np.square(np.asarray(limits, dtype=float))
+    s = np.asarray(s, dtype=float)
+    # Backward pass: v_i^2 <= min over j >= i of v_j^2 + 2a(s_j - s_i).
+    squared = np.minimum.accumulate((squared + 2*a*s)[::-1])[::-1] - 2*a*s
+    # Forward pass: v_i^2 <= min over j <= i of v_j^2 + 2a(s_i - s_j).
+    squared = np.minimum.accumulate(squared - 2*a*s) + 2*a*s
+    return np.sqrt(np.maximum(squared, 0.0))
+
+# Speeds reached from v_0 when the acceleration builds up from zero to a with
+# a constant jerk j, then stays at a.
+def jerk_limited_speeds(v_0, s, a, j):
+    """Computes the highest speeds reachable from the start speed with a jerk
+    limited acceleration.
+
+    args:
+        v_0: start speed (m/s), at zero acceleration.
+        s: array of the arc length (m) of each point.
+        a: maximum acceleration (m/s^2)
+        j: maximum jerk (m/s^3)
+    returns:
+        speeds: array of the speeds (m/s) at each point.
+    """
+    s = np.asarray(s, dtype=float)
+    # Jerk phase: v = v_0 + j t^2 / 2 and d = v_0 t + j t^3 / 6 until t_1 = a / j.
+    t_1 = a / j
+    v_1 = v_0 + j*t_1*t_1/2
+    s_1 = v_0*t_1 + j*t_1**3/6
+    # Constant acceleration phase, up to the end of the path.
+    t_end = t_1 + max(calc_final_speed(v_1, a, s[-1] - s_1) - v_1, 0.0) / a
+    t = np.linspace(0.0, t_end, JERK_SAMPLES)
+    t_a = np.maximum(t - t_1, 0.0)
+    t_j = np.minimum(t, t_1)
+    v = v_0 + j*t_j*t_j/2 + a*t_a
+    d = v_0*t_j + j*t_j**3/6 + (v_1*t_a + a*t_a*t_a/2)
+    return np.interp(s, d, v, right=v[-1])
+
+# Distance from the ego vehicle to the stop line, at the end of the path.
+def stop_line_distance(path, ego_state):
+    """Returns the straight line distance (m) from the ego vehicle to the last
+    point of the path."""
+    x, y, _ = path_arc_length(path)
+    return np.hypot(x[-1] - ego_state[0], y[-1] - ego_state[1])
+
+# Computes the cumulative arc length along a path once, for all of the
+# profile computations. The arc length of a PlannedPath is already cached.
+def path_arc_length(path):
+    """Computes the arc length of each point of a path.
+
+    args:
+        path: Path (global frame), format: [x_points, y_points, t_points],
+            or a PlannedPath.
+    returns:
+        [x, y, s]: arrays of the x and y values (m) of the points, and of the
+            arc length (m) from the start of the path to each point.
+    """
+    if isinstance(path, PlannedPath):
+        return path.x, path.y, path.s
+    x = np.asarray(path[0], dtype=float)
+    y = np.asarray(path[1], dtype=float)
+    s = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))))
+    return x, y, s
@@ -7,9 +7,9 @@ import tensorflow as tf
 import os
 import numpy as np
 
-from postprocessing import decode_netout, interval_overlap, compute_overlap, compute_ap
-from preprocessing import load_image_predict, load_carla_data
-from utils import BatchGenerator
+from postprocessing import decode_netout, compute_overlap, compute_ap
+# The training data pipeline (pandas, sklearn, imgaug) is only imported by the
+# methods that need it, so that the inference path does not pay for it.
 
 
 BASE_DIR = os.path.dirname(__file__)
@@ -131,6 +131,10 @@ class YOLO(object):
             pretrained.get_layer('DetectionLayer').get_weights())
 
 
+    def export_inference_model(self, model_path):
+        inference_model(self.model).save(model_path, include_optimizer=False)
+
+
     def load_weights(self, model_path):
         model = load_model(model_path, custom_objects={'custom_loss': self.custom_loss, 'tf': tf})
 
@@ -141,6 +145,8 @@ class YOLO(object):
 
 
     def predict(self, image_path):
+        from preprocessing import load_image_predict
+
         image = load_image_predict(image_path, self.image_h, self.image_w)
 
         dummy_array = np.zeros((1, 1, 1, 1, self.max_box_per_image, 4))
@@ -152,6 +158,9 @@ class YOLO(object):
 
 
     def train(self):
+        from preprocessing import load_carla_data
+        from utils import BatchGenerator
+
         data = load_carla_data(os.path.join(ANNOT_DIR, self.config['train']['annot_file_name']), self.config['model']['classes'])
 
         np.random.shuffle(data)
@@ -203,6 +212,9 @@ class YOLO(object):
 
 
     def evaluate(self):
+        from preprocessing import load_carla_data
+        from utils import BatchGenerator
+
         data = load_carla_data(os.path.join(ANNOT_DIR, self.config['train']['annot_file_name']),
                                self.config['model']['classes'])
 
@@ -589,5 +601,15 @@ class YOLO(object):
             return average_precisions
 
 
+def inference_model(model):
+    """Inference-only version of a trained YOLO model: the image in and the
+    output grid out, without the true_boxes input and the Lambda passthrough
+    that only carry the ground truth to the loss during training."""
+    passthrough = [layer for layer in model.layers if isinstance(layer, Lambda)]
+    if not passthrough:
+        return model
+    return Model(model.inputs[0], passthrough[-1].input[0])
+
+
 def dummy_loss(y_true, y_pred):
     return tf.sqrt(tf.reduce_sum(y_pred))
\ No newline at end of file